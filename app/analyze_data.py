@@ -2,10 +2,11 @@
 
 import pandas as pd
 from pathlib import Path
+from helpers.config import OBSERVATIONS_FILE
 import matplotlib.pyplot as plt
 import re
 
-input_file = Path("/data/observations.parquet")
+input_file = OBSERVATIONS_FILE
 
 
 '''
@@ -1,15 +1,28 @@
 # Loads data from parquet to a Pandas dataframe from a parquet file and shows some statistics
 
 import pandas as pd
+import polars as pl
 import geopandas as gpd
 import matplotlib.pyplot as plt
 from shapely.geometry import Point
 from pathlib import Path
+from helpers.config import OBSERVATIONS_FILE
+from helpers.fingerprint import fingerprint_frame, load_manifest, save_manifest, is_up_to_date
+from helpers.instrumentation import stage, write_run_report
 import re
 import gc
+import sys
 import numpy as np
 
-input_file = Path("/data/observations.parquet")
+input_file = OBSERVATIONS_FILE
+
+# Hexagon size in degrees
+HEX_SIZE = 0.2
+HEATMAP_DPI = 300
+
+output_dir = Path("./output")
+output_file = output_dir / "finland_bird_observations_heatmap.png"
+pdf_file = output_dir / "finland_bird_observations_heatmap.pdf"
 
 
 '''
@@ -44,7 +57,9 @@ lon_min = 19.032174
 lon_max = 31.587662
 
 # Read only columns user_anon, finbif_species, month
-df = pd.read_parquet(input_file, columns=["user_anon", "finbif_species", "lat", "lon", "prediction"])
+with stage("read_parquet") as record:
+    df = pd.read_parquet(input_file, columns=["user_anon", "finbif_species", "lat", "lon", "prediction"])
+    record["rows_out"] = len(df)
 
 # Remove rows where certain fields are empty
 df = df.dropna(subset=["user_anon", "finbif_species", "lat", "lon"])
@@ -60,6 +75,16 @@ df = df[
     (df['lon'] <= lon_max)
 ]
 
+# Skip rendering if the heatmap has already been rendered from the same data and parameters
+fingerprint = fingerprint_frame(pl.from_pandas(df, include_index=False), {"hex_size": HEX_SIZE, "dpi": HEATMAP_DPI})
+manifest = load_manifest(output_dir)
+if is_up_to_date(manifest, output_file, fingerprint) and is_up_to_date(manifest, pdf_file, fingerprint):
+    print(f"Skipping heatmap because {output_file} is up to date")
+    # Saved also when up to date, so that the manifest shows the heatmap was checked against the current data
+    save_manifest(output_dir, manifest)
+    write_run_report("analyze_heatmap")
+    sys.exit()
+
 # Load Finland borders from local Natural Earth data
 world = gpd.read_file("./ne_110m_admin_0_countries/ne_110m_admin_0_countries.shp")
 finland = world[world.NAME == "Finland"]
@@ -108,7 +133,7 @@ def create_hex_grid(bounds, hex_size=0.1):
 
 # Create hexagonal grid covering Finland
 finland_bounds = finland.total_bounds
-hex_grid = create_hex_grid(finland_bounds, hex_size=0.2)  # Adjust hex_size as needed
+hex_grid = create_hex_grid(finland_bounds, hex_size=HEX_SIZE)
 
 # Convert observations to GeoDataFrame
 observation_points = gpd.GeoDataFrame(
@@ -118,11 +143,13 @@ observation_points = gpd.GeoDataFrame(
 )
 
 # Count observations in each hexagon
-hex_grid['observation_count'] = 0
-for idx, hex_geom in hex_grid.iterrows():
-    # Count points that intersect with this hexagon
-    count = sum(observation_points.geometry.intersects(hex_geom.geometry))
-    hex_grid.loc[idx, 'observation_count'] = count
+with stage("count_hexagons", rows_in=len(observation_points)) as record:
+    hex_grid['observation_count'] = 0
+    for idx, hex_geom in hex_grid.iterrows():
+        # Count points that intersect with this hexagon
+        count = sum(observation_points.geometry.intersects(hex_geom.geometry))
+        hex_grid.loc[idx, 'observation_count'] = count
+    record["rows_out"] = len(hex_grid)
 
 # Filter hexagons that have observations and are within Finland
 hex_grid = hex_grid[hex_grid['observation_count'] > 0]
@@ -181,18 +208,20 @@ ax2.text(0.05, 0.95, stats_text, transform=ax2.transAxes,
 plt.tight_layout()
 
 # Create output directory if it doesn't exist
-output_dir = Path("./output")
 output_dir.mkdir(exist_ok=True)
 
 # Save the map
-output_file = output_dir / "finland_bird_observations_heatmap.png"
-plt.savefig(output_file, dpi=300, bbox_inches='tight', facecolor='white')
-print(f"Map saved to: {output_file}")
+with stage("save_heatmap"):
+    plt.savefig(output_file, dpi=HEATMAP_DPI, bbox_inches='tight', facecolor='white')
+    print(f"Map saved to: {output_file}")
 
-# Also save a high-quality PDF version
-pdf_file = output_dir / "finland_bird_observations_heatmap.pdf"
-plt.savefig(pdf_file, bbox_inches='tight', facecolor='white')
-print(f"PDF version saved to: {pdf_file}")
+    # Also save a high-quality PDF version
+    plt.savefig(pdf_file, bbox_inches='tight', facecolor='white')
+    print(f"PDF version saved to: {pdf_file}")
+
+manifest[output_file.name] = fingerprint
+manifest[pdf_file.name] = fingerprint
+save_manifest(output_dir, manifest)
 
 plt.show()
 
@@ -217,3 +246,5 @@ print(df['user_anon'].value_counts().head(10))
 del df, hex_grid, observation_points
 gc.collect()
 
+
+write_run_report("analyze_heatmap")
@@ -1,14 +1,30 @@
 # Loads data  from Parquet to a Pandas dataframe from a parquet file and creates spatial statistics and maps of the observations
 
 import pandas as pd
+import polars as pl
 import geopandas as gpd
 import matplotlib.pyplot as plt
+from matplotlib.colors import LogNorm
 from shapely.geometry import Point
 from pathlib import Path
+from helpers.config import OBSERVATIONS_FILE
+from helpers.fingerprint import fingerprint_frame, load_manifest, save_manifest, is_up_to_date
+from helpers.instrumentation import stage, write_run_report
 import re
 import gc
+import numpy as np
 
-input_file = Path("/data/observations.parquet")
+input_file = OBSERVATIONS_FILE
+
+# Map rendering mode: "raster" bins observations into a 2D histogram drawn as a single image layer,
+# "points" draws each observation as a separate marker
+RENDER_MODE = "raster"
+
+# Raster resolution as (latitude, longitude) bins over the Finland bounding box
+RASTER_BINS = (500, 300)
+
+MAP_MONTHS = [5, 6, 7]
+MAP_DPI = 300
 
 # Print schema of the dataframe
 #print(pd.read_parquet(input_file).dtypes)
@@ -55,66 +71,135 @@ lat_max = 70.095071
 lon_min = 19.032174
 lon_max = 31.587662
 
+def plot_points(ax, species_df):
+    """Draw each observation as a point."""
+    geometry = [Point(xy) for xy in zip(species_df['lon'], species_df['lat'])]
+    gdf = gpd.GeoDataFrame(species_df, geometry=geometry, crs="EPSG:4326")
+    gdf.plot(ax=ax, markersize=2, color='red')
+
+
+def plot_raster(ax, species_df):
+    """Draw observation counts binned into a 2D histogram as a single image with a log colour scale."""
+    counts, _, _ = np.histogram2d(
+        species_df['lat'].to_numpy(),
+        species_df['lon'].to_numpy(),
+        bins=RASTER_BINS,
+        range=[[lat_min, lat_max], [lon_min, lon_max]]
+    )
+
+    # Keep the map aspect and extent set by the Finland outline
+    aspect = ax.get_aspect()
+    xlim, ylim = ax.get_xlim(), ax.get_ylim()
+
+    image = ax.imshow(
+        np.ma.masked_equal(counts, 0),
+        origin='lower',
+        extent=(lon_min, lon_max, lat_min, lat_max),
+        norm=LogNorm(vmin=1, vmax=max(counts.max(), 1)),
+        cmap='inferno_r',
+        interpolation='nearest',
+        zorder=2
+    )
+    finland.boundary.plot(ax=ax, color='black', linewidth=0.5, zorder=3)
+
+    ax.set_aspect(aspect)
+    ax.set_xlim(xlim)
+    ax.set_ylim(ylim)
+    plt.colorbar(image, ax=ax, shrink=0.6, label='Observations')
+
+
+# Parameters that affect the maps, a change in them re-renders all maps
+render_params = {
+    "render_mode": RENDER_MODE,
+    "raster_bins": RASTER_BINS if RENDER_MODE == "raster" else None,
+    "months": MAP_MONTHS,
+    "dpi": MAP_DPI,
+}
+
+# Fingerprints of rendered maps, only maps whose data or parameters have changed are re-rendered
+manifest = load_manifest(output_dir)
+
 # Get unique species list first
 species_list = pd.read_parquet(input_file, columns=["finbif_species"])["finbif_species"].unique()
 
+# Maps of species with observations in the current data
+current_maps = set()
+
 # Process each species
 for species in species_list:
-    # Create filename from species name (replace spaces and special characters)
-    safe_species_name = re.sub(r'[^a-zA-Z0-9]', '_', species)
-    output_file = output_dir / f"map_{safe_species_name}.png"
-    if output_file.exists():
-        print(f"Skipping {species} because map exists")
-        continue
-
-    print(f"Processing {species}")
-
-    # Read only data for current species
-    species_df = pd.read_parquet(
-        input_file,
-        columns=["user_anon", "finbif_species", "lat", "lon", "month"],
-        filters=[("finbif_species", "==", species)]
-    )
+    with stage("render_species_map", detail=species) as record:
+        # Create filename from species name (replace spaces and special characters)
+        safe_species_name = re.sub(r'[^a-zA-Z0-9]', '_', species)
+        output_file = output_dir / f"map_{safe_species_name}.png"
+
+        # Read only data for current species
+        species_df = pd.read_parquet(
+            input_file,
+            columns=["user_anon", "finbif_species", "lat", "lon", "month"],
+            filters=[("finbif_species", "==", species)]
+        )
     
-    # Filter for summer months
-    species_df = species_df[species_df['month'].isin([5, 6, 7])]
+        # Filter for summer months
+        species_df = species_df[species_df['month'].isin(MAP_MONTHS)]
     
-    # Filter coordinates
-    species_df = species_df[
-        (species_df['lat'] >= lat_min) & 
-        (species_df['lat'] <= lat_max) & 
-        (species_df['lon'] >= lon_min) & 
-        (species_df['lon'] <= lon_max)
-    ]
+        # Filter coordinates
+        species_df = species_df[
+            (species_df['lat'] >= lat_min) & 
+            (species_df['lat'] <= lat_max) & 
+            (species_df['lon'] >= lon_min) & 
+            (species_df['lon'] <= lon_max)
+        ]
     
-    # Skip if no observations for this species
-    if len(species_df) == 0:
-        continue
+        # Skip if no observations for this species. Its map from earlier data is removed after the loop.
+        if len(species_df) == 0:
+            continue
+        current_maps.add(output_file.name)
 
-    observation_count = len(species_df)
-    
-    # Remove rows where lat or lon is empty
-    species_df = species_df.dropna(subset=["user_anon", "lat", "lon"])
+        observation_count = len(species_df)
+        record["rows_in"] = observation_count
     
-    # Convert lat and lon to float
-    species_df["lat"] = species_df["lat"].astype(float)
-    species_df["lon"] = species_df["lon"].astype(float)
+        # Remove rows where lat or lon is empty
+        species_df = species_df.dropna(subset=["user_anon", "lat", "lon"])
     
-    # Convert to GeoDataFrame
-    geometry = [Point(xy) for xy in zip(species_df['lon'], species_df['lat'])]
-    gdf = gpd.GeoDataFrame(species_df, geometry=geometry, crs="EPSG:4326")
+        # Convert lat and lon to float
+        species_df["lat"] = species_df["lat"].astype(float)
+        species_df["lon"] = species_df["lon"].astype(float)
+
+        fingerprint = fingerprint_frame(pl.from_pandas(species_df, include_index=False), render_params)
+        if is_up_to_date(manifest, output_file, fingerprint):
+            print(f"Skipping {species} because map is up to date")
+            continue
+
+        print(f"Processing {species}")
     
-    # Create a map of Finland with the points
-    plt.figure(figsize=(10, 10))
-    ax = finland.plot(color='white', edgecolor='black')
-    gdf.plot(ax=ax, markersize=2, color='red')
-    plt.title(f"{observation_count} obs of {species}")
-    plt.axis('off')
+        # Create a map of Finland with the observations
+        plt.figure(figsize=(10, 10))
+        ax = finland.plot(color='white', edgecolor='black')
+        if RENDER_MODE == "raster":
+            plot_raster(ax, species_df)
+        else:
+            plot_points(ax, species_df)
+        plt.title(f"{observation_count} obs of {species}")
+        plt.axis('off')
     
-    # Save map
-    plt.savefig(output_file, bbox_inches='tight', dpi=300)
-    plt.close('all')  # Close all figures
+        # Save map
+        plt.savefig(output_file, bbox_inches='tight', dpi=MAP_DPI)
+        plt.close('all')  # Close all figures
+
+        manifest[output_file.name] = fingerprint
+        save_manifest(output_dir, manifest)
     
-    # Clear memory
-    del species_df, gdf, geometry
-    gc.collect()
\ No newline at end of file
+        # Clear memory
+        del species_df
+        gc.collect()
+
+# Remove maps rendered from earlier data of species that no longer have observations
+for map_name in sorted(set(manifest) - current_maps):
+    print(f"Removing {map_name}, species has no observations")
+    (output_dir / map_name).unlink(missing_ok=True)
+    del manifest[map_name]
+
+# Saved also when all maps are up to date, so that the manifest shows the maps were checked against the current data
+save_manifest(output_dir, manifest)
+
+write_run_report("analyze_maps")
@@ -1,14 +1,17 @@
-# Loads data to a Pandas dataframe from a parquet file and shows some statistics
+# Counts observations per species and month from a parquet file and draws monthly charts of each species
 
-import pandas as pd
-from pathlib import Path
+import polars as pl
+import numpy as np
+from helpers.config import DATA_DIR, OBSERVATIONS_FILE
+from helpers.fingerprint import fingerprint_frame, load_manifest, save_manifest, is_up_to_date
+from helpers.instrumentation import stage, write_run_report
 import matplotlib.pyplot as plt
 import re
 
-input_file = Path("/data/observations.parquet")
+input_file = OBSERVATIONS_FILE
 
 # Print schema of the dataframe
-#print(pd.read_parquet(input_file).dtypes)
+#print(pl.read_parquet_schema(input_file))
 #exit()
 
 '''
@@ -35,43 +38,120 @@ isheard', Boolean, whether the bird was heard or not, can be empty
 finbif_species', String, scientific name of the bird species from FinBIF
 identifier', String, identifier of the bird species from FinBIF
 '''
-# Read only columns user_anon, finbif_species, month
-df = pd.read_parquet(input_file, columns=["user_anon", "finbif_species", "month"])
+# Number of species per figure. With 1, each species gets its own chart, larger numbers batch species into multi-panel figures.
+PANELS_PER_FIGURE = 1
+PANEL_COLUMNS = 4
 
-# Remove rows where certain fields are empty
-df = df.dropna(subset=["user_anon", "finbif_species", "month"])
+output_dir = DATA_DIR / "output"
+output_dir.mkdir(parents=True, exist_ok=True)
+monthly_counts_file = output_dir / "monthly_counts.csv"
 
-# Cast month to integer
-df["month"] = df["month"].astype(int)
+# Count observations per species and month in a single pass, reading only the needed columns
+with stage("count_monthly") as record:
+    monthly_counts = pl.scan_parquet(input_file) \
+        .select(["user_anon", "finbif_species", "month"]) \
+        .drop_nulls() \
+        .with_columns(pl.col("month").cast(pl.Int32)) \
+        .group_by(["finbif_species", "month"]) \
+        .agg(pl.len().alias("count")) \
+        .sort(["finbif_species", "month"]) \
+        .collect()
+    record["rows_out"] = len(monthly_counts)
+
+# Save the counts table, so that it can be reused without reading the observations
+monthly_counts.write_csv(monthly_counts_file, separator=";")
+print(f"Saved monthly counts to {monthly_counts_file}")
+
+# Reshape to a matrix with a row for each species and a column for each month, with zeros for months without observations
+months = list(range(1, 13))
+monthly_counts = monthly_counts.filter(pl.col("month").is_between(1, 12))
+species_list = monthly_counts["finbif_species"].unique(maintain_order=True).to_list()
+species_rows = (monthly_counts["finbif_species"].rank("dense") - 1).cast(pl.Int64).to_numpy()
+
+count_matrix = np.zeros((len(species_list), len(months)), dtype=np.int64)
+count_matrix[species_rows, monthly_counts["month"].to_numpy() - 1] = monthly_counts["count"].to_numpy()
 
 # Function to create safe filename from species name
 def safe_filename(species):
     # Replace spaces and special characters with underscores
     return re.sub(r'[^a-zA-Z0-9]', '_', species)
 
-# Group by species and month, then create a chart for each species
-for species in df["finbif_species"].unique():
-    # Filter data for this species
-    species_data = df[df["finbif_species"] == species]
-    
-    # Group by month and count
-    monthly_counts = species_data.groupby("month").size().reindex(range(1, 13), fill_value=0).reset_index(name="count")
-    monthly_counts = monthly_counts.sort_values("month")
-    
-    # Create the plot
-    plt.figure(figsize=(10, 6))
-    plt.bar(monthly_counts["month"], monthly_counts["count"])
-    plt.title(f"Monthly observations of {species}")
-    plt.xlabel("Month")
-    plt.ylabel("Number of observations")
-    plt.xticks(range(1, 13))
-    
-    # Save the chart with species name in filename
-    safe_species_name = safe_filename(species)
-    plt.savefig(f"/data/output/monthly_{safe_species_name}.png")
-    plt.close()
-
-# Save as csv for debugging purposes
-#df.to_csv("/data/output/observations_sample.csv")
-#exit()
+def plot_monthly_counts(ax, species, counts):
+    """Draw a bar chart of monthly counts of a species."""
+    ax.bar(months, counts)
+    ax.set_title(f"Monthly observations of {species}")
+    ax.set_xlabel("Month")
+    ax.set_ylabel("Number of observations")
+    ax.set_xticks(months)
+
+def chart_fingerprint(species_names, counts):
+    """Fingerprint of the monthly counts and layout of a chart."""
+    chart_data = pl.DataFrame({
+        "finbif_species": np.repeat(species_names, len(months)),
+        "month": months * len(species_names),
+        "count": np.ravel(counts),
+    })
+    return fingerprint_frame(chart_data, {"panels_per_figure": PANELS_PER_FIGURE, "panel_columns": PANEL_COLUMNS})
+
+# Fingerprints of rendered charts, only charts whose counts or layout have changed are re-rendered
+manifest = load_manifest(output_dir)
+
+# Charts of the current data and layout
+current_outputs = set()
+
+if PANELS_PER_FIGURE <= 1:
+    # Create a chart for each species
+    for species, counts in zip(species_list, count_matrix):
+        with stage("render_chart", detail=species):
+            # Save the chart with species name in filename
+            safe_species_name = safe_filename(species)
+            output_file = output_dir / f"monthly_{safe_species_name}.png"
+            current_outputs.add(output_file.name)
+            fingerprint = chart_fingerprint([species], [counts])
+            if is_up_to_date(manifest, output_file, fingerprint):
+                continue
+
+            fig, ax = plt.subplots(figsize=(10, 6))
+            plot_monthly_counts(ax, species, counts)
+            fig.savefig(output_file)
+            plt.close(fig)
+            manifest[output_file.name] = fingerprint
+else:
+    # Create multi-panel figures, each with a batch of species
+    n_columns = min(PANEL_COLUMNS, PANELS_PER_FIGURE)
+    n_rows = -(-PANELS_PER_FIGURE // n_columns)
+
+    for batch_number, batch_start in enumerate(range(0, len(species_list), PANELS_PER_FIGURE), start=1):
+        with stage("render_chart", detail=f"batch {batch_number}"):
+            batch_species = species_list[batch_start:batch_start + PANELS_PER_FIGURE]
+            batch_counts = count_matrix[batch_start:batch_start + PANELS_PER_FIGURE]
+            output_file = output_dir / f"monthly_batch_{batch_number:03d}.png"
+            current_outputs.add(output_file.name)
+            fingerprint = chart_fingerprint(batch_species, batch_counts)
+            if is_up_to_date(manifest, output_file, fingerprint):
+                continue
+
+            fig, axes = plt.subplots(n_rows, n_columns, figsize=(5 * n_columns, 3.5 * n_rows), squeeze=False)
+
+            for ax, species, counts in zip(axes.flat, batch_species, batch_counts):
+                plot_monthly_counts(ax, species, counts)
+
+            # Hide unused panels of the last batch
+            for ax in axes.flat[len(batch_species):]:
+                ax.axis("off")
+
+            fig.tight_layout()
+            fig.savefig(output_file)
+            plt.close(fig)
+            manifest[output_file.name] = fingerprint
+
+# Remove charts of species that no longer have observations, and batches beyond the current batch count
+for chart_name in sorted(set(manifest) - current_outputs):
+    print(f"Removing {chart_name}, chart is not in the current data")
+    (output_dir / chart_name).unlink(missing_ok=True)
+    del manifest[chart_name]
+
+save_manifest(output_dir, manifest)
+print(f"Saved charts to {output_dir}")
 
+write_run_report("analyze_months")
@@ -1,8 +1,13 @@
 # Script to compare observations to bird atlas results and save observations to a file, if they would be a new species for the square
 
+import argparse
+import itertools
 import polars as pl
 from pathlib import Path
 from helpers.get_atlas_data import fetch_square_data, get_cached_square_data, read_bird_species_lookup
+from helpers.square_index import sort_and_index, get_square_slice
+from helpers.config import OBSERVATIONS_YKJ_FILE
+from helpers.instrumentation import stage, write_run_report
 import json
 
 # Configuration constants
@@ -14,13 +19,21 @@ ALREADY_OBSERVED_VALUES = ["MY.atlasClassEnumA", "MY.atlasClassEnumB", "MY.atlas
 
 # File paths
 SQUARES_FILE = Path("./data/atlas_squares.csv")
-OBSERVATION_DATA_FILE = Path("/data/observations_ykj.parquet")
+OBSERVATION_DATA_FILE = OBSERVATIONS_YKJ_FILE
 PREDICTIONS_DIR = Path("./data/atlas_predictions_2024")
 
 RESULTS_FILE = Path("./output/atlas_results.csv")
 
+# Sweep mode evaluates all combinations of these settings in one pass over the observations
+SWEEP_PREDICTION_THRESHOLDS = [0.9, 0.95, 0.98]
+SWEEP_ATLAS_PREDICTION_THRESHOLDS = [0.8, 0.9, 1.0]
+SWEEP_OBSERVATION_MONTHS = [(5, 7), (4, 7), (5, 6), (6, 7)]
 
-def load_and_filter_observations():
+SWEEP_CANDIDATES_FILE = Path("./output/atlas_sweep_candidates.csv")
+SWEEP_SUMMARY_FILE = Path("./output/atlas_sweep_summary.csv")
+
+
+def load_and_filter_observations(observation_months=OBSERVATION_MONTHS, prediction_threshold=PREDICTION_THRESHOLD):
     """Load and pre-filter observation data from parquet file."""
     print("Loading and filtering observation data...")
 
@@ -51,11 +64,13 @@ def load_and_filter_observations():
     'e', Integer, Finnish uniform grid system (ykj) EPSG:2393 row
     '''
 
-    observations = pl.scan_parquet(OBSERVATION_DATA_FILE) \
-        .select(["lat", "lon", "n", "e", "prediction", "month", "identifier", "rec_id", "result_id", "song_start", "isseen", "isheard", "date"]) \
-        .filter(pl.col("month").is_between(*OBSERVATION_MONTHS)) \
-        .filter(pl.col("prediction") >= PREDICTION_THRESHOLD) \
-        .collect()
+    with stage("load_and_filter_observations") as record:
+        observations = pl.scan_parquet(OBSERVATION_DATA_FILE) \
+            .select(["lat", "lon", "n", "e", "prediction", "month", "identifier", "rec_id", "result_id", "song_start", "isseen", "isheard", "date"]) \
+            .filter(pl.col("month").is_between(*observation_months)) \
+            .filter(pl.col("prediction") >= prediction_threshold) \
+            .collect()
+        record["rows_out"] = len(observations)
     
     print(f"Loaded {len(observations)} total observations")
     return observations
@@ -72,10 +87,9 @@ def get_already_observed_species(square_data):
     return already_observed_species
 
 
-def filter_observations_by_square(observations_df, ykj_n, ykj_e, already_observed_species):
-    """Filter observations for a specific square and remove already observed species."""
-    square_observations = observations_df.filter(pl.col("n") == ykj_n) \
-        .filter(pl.col("e") == ykj_e)
+def filter_observations_by_square(observations_df, square_index, ykj_n, ykj_e, already_observed_species):
+    """Slice observations for a specific square and remove already observed species."""
+    square_observations = get_square_slice(observations_df, square_index, ykj_n, ykj_e)
     
     print(f"Number of observations: {len(square_observations)}")
     
@@ -147,16 +161,25 @@ def create_empty_dataframe_with_schema(observations_df):
     return pl.DataFrame(schema=schema_with_metadata)
 
 
-def write_results_to_file(observations_df, is_first_iteration):
+def write_results_to_file(observations_df, is_first_iteration, results_file=RESULTS_FILE):
     """Write results to CSV file, with header only for first iteration."""
     if is_first_iteration:
-        observations_df.write_csv(RESULTS_FILE, separator=";")
+        observations_df.write_csv(results_file, separator=";")
     else:
-        with open(RESULTS_FILE, 'a') as f:
+        with open(results_file, 'a') as f:
             observations_df.write_csv(f, separator=";", include_header=False)
 
 
-def process_square(square_row, all_observations, bird_species_lookup):
+def get_square_info(square_data):
+    """Extract square information from atlas square data."""
+    return {
+        "name": square_data["name"],
+        "activity_category": square_data["activityCategory"]["value"],
+        "bird_association_area": square_data["birdAssociationArea"]["value"]
+    }
+
+
+def process_square(square_row, all_observations, square_index, bird_species_lookup):
     """Process a single square and return filtered observations."""
     ykj_n = square_row["ykj_n"]
     ykj_e = square_row["ykj_e"]
@@ -164,39 +187,165 @@ def process_square(square_row, all_observations, bird_species_lookup):
     
     print(f"Processing square: {square_name} ({ykj_n}:{ykj_e})")
     
-    # Get square data from atlas
-    try:
-        square_data = get_cached_square_data(ykj_n, ykj_e)
-    except Exception as e:
-        print(f"Error getting data for square {square_name}: {str(e)}")
-        return None
+    with stage("process_square", detail=f"{ykj_n}:{ykj_e}") as record:
+        # Get square data from atlas
+        try:
+            square_data = get_cached_square_data(ykj_n, ykj_e)
+        except Exception as e:
+            print(f"Error getting data for square {square_name}: {str(e)}")
+            return None
     
-    # Extract square information
-    square_info = {
-        "name": square_data["name"],
-        "activity_category": square_data["activityCategory"]["value"],
-        "bird_association_area": square_data["birdAssociationArea"]["value"]
-    }
+        square_info = get_square_info(square_data)
     
-    # Get already observed species
-    already_observed_species = get_already_observed_species(square_data)
+        # Get already observed species
+        already_observed_species = get_already_observed_species(square_data)
     
-    # Filter observations for this square
-    square_observations = filter_observations_by_square(
-        all_observations, ykj_n, ykj_e, already_observed_species
-    )
+        # Filter observations for this square
+        square_observations = filter_observations_by_square(
+            all_observations, square_index, ykj_n, ykj_e, already_observed_species
+        )
+        record["rows_in"] = len(square_observations)
     
-    # Load predictions and filter by atlas predictions
-    predictions = load_predictions_for_square(ykj_n, ykj_e)
-    filtered_observations = filter_by_atlas_predictions(
-        square_observations, predictions, bird_species_lookup, square_info
-    )
+        # Load predictions and filter by atlas predictions
+        predictions = load_predictions_for_square(ykj_n, ykj_e)
+        filtered_observations = filter_by_atlas_predictions(
+            square_observations, predictions, bird_species_lookup, square_info
+        )
     
-    print(f"Number of observations after filtering: {len(filtered_observations)}")
-    return filtered_observations
+        print(f"Number of observations after filtering: {len(filtered_observations)}")
+        record["rows_out"] = len(filtered_observations)
+        return filtered_observations
+
+
+def get_sweep_settings():
+    """Return all combinations of sweep settings as a dataframe."""
+    return pl.DataFrame([
+        {
+            "prediction_threshold": prediction_threshold,
+            "atlas_prediction_threshold": atlas_prediction_threshold,
+            "month_start": month_start,
+            "month_end": month_end
+        }
+        for prediction_threshold, atlas_prediction_threshold, (month_start, month_end) in itertools.product(
+            SWEEP_PREDICTION_THRESHOLDS, SWEEP_ATLAS_PREDICTION_THRESHOLDS, SWEEP_OBSERVATION_MONTHS
+        )
+    ])
+
+
+def strictest_passed(column, thresholds):
+    """Expression for the highest threshold that the column value reaches, or null if it reaches none."""
+    expression = pl.lit(None, dtype=pl.Float64)
+    for threshold in sorted(thresholds):
+        expression = pl.when(pl.col(column) >= threshold).then(pl.lit(threshold)).otherwise(expression)
+    return expression
+
+
+def get_atlas_prediction_values(predictions, bird_species_lookup):
+    """Return atlas prediction values of a square as a dataframe of species identifiers."""
+    rows = []
+    for identifier, finnish_name in bird_species_lookup.items():
+        prediction_data = predictions.get(finnish_name)
+        if not prediction_data or "predictions" not in prediction_data or not prediction_data["predictions"]:
+            continue
+        rows.append({
+            "identifier": identifier,
+            "finnish_name": finnish_name,
+            "atlas_prediction": prediction_data["predictions"][0]["value"]
+        })
 
+    return pl.DataFrame(rows, schema={"identifier": pl.Utf8, "finnish_name": pl.Utf8, "atlas_prediction": pl.Float64})
 
-def main():
+
+def sweep_square(square_row, all_observations, square_index, bird_species_lookup, sweep_settings):
+    """Tag observations of a square with the strictest sweep settings they pass, and count new species for each setting."""
+    ykj_n = square_row["ykj_n"]
+    ykj_e = square_row["ykj_e"]
+    square_name = square_row["square_name"]
+
+    print(f"Sweeping square: {square_name} ({ykj_n}:{ykj_e})")
+
+    with stage("sweep_square", detail=f"{ykj_n}:{ykj_e}") as record:
+        try:
+            square_data = get_cached_square_data(ykj_n, ykj_e)
+        except Exception as e:
+            print(f"Error getting data for square {square_name}: {str(e)}")
+            return None, None
+
+        square_info = get_square_info(square_data)
+        already_observed_species = get_already_observed_species(square_data)
+        square_observations = filter_observations_by_square(
+            all_observations, square_index, ykj_n, ykj_e, already_observed_species
+        )
+        record["rows_in"] = len(square_observations)
+
+        # Tag candidates with the highest thresholds they pass, and drop those passing none
+        predictions = load_predictions_for_square(ykj_n, ykj_e)
+        candidates = square_observations \
+            .join(get_atlas_prediction_values(predictions, bird_species_lookup), on="identifier", how="inner") \
+            .with_columns([
+                strictest_passed("prediction", SWEEP_PREDICTION_THRESHOLDS).alias("passes_prediction_threshold"),
+                strictest_passed("atlas_prediction", SWEEP_ATLAS_PREDICTION_THRESHOLDS).alias("passes_atlas_prediction_threshold"),
+                pl.lit(square_info["name"]).alias("square_name"),
+                pl.lit(square_info["activity_category"]).alias("activity_category"),
+                pl.lit(square_info["bird_association_area"]).alias("bird_association_area")
+            ]) \
+            .drop_nulls(["passes_prediction_threshold", "passes_atlas_prediction_threshold"])
+        record["rows_out"] = len(candidates)
+
+        # Count species passing each setting. Candidates are first reduced to distinct species, month and tags,
+        # so that the cross join with the settings stays small.
+        setting_columns = sweep_settings.columns
+        passing = candidates \
+            .group_by(["identifier", "month", "passes_prediction_threshold", "passes_atlas_prediction_threshold"]) \
+            .agg(pl.len().alias("observations")) \
+            .join(sweep_settings, how="cross") \
+            .filter(
+                (pl.col("passes_prediction_threshold") >= pl.col("prediction_threshold"))
+                & (pl.col("passes_atlas_prediction_threshold") >= pl.col("atlas_prediction_threshold"))
+                & pl.col("month").is_between(pl.col("month_start"), pl.col("month_end"))
+            ) \
+            .group_by(setting_columns) \
+            .agg([
+                pl.col("identifier").n_unique().alias("new_species"),
+                pl.col("observations").sum()
+            ])
+
+        summary = sweep_settings \
+            .join(passing, on=setting_columns, how="left") \
+            .with_columns([
+                pl.lit(ykj_n).alias("ykj_n"),
+                pl.lit(ykj_e).alias("ykj_e"),
+                pl.lit(square_info["name"]).alias("square_name"),
+                pl.col("new_species").fill_null(0),
+                pl.col("observations").fill_null(0)
+            ]) \
+            .select(["ykj_n", "ykj_e", "square_name"] + setting_columns + ["new_species", "observations"])
+
+        print(f"Number of candidate observations: {len(candidates)}")
+        return candidates, summary
+
+
+def write_sweep_summary(summaries):
+    """Write per-square sweep summary to CSV file and print totals of each setting."""
+    if not summaries:
+        print("No squares swept")
+        return
+
+    summary = pl.concat(summaries)
+    summary.write_csv(SWEEP_SUMMARY_FILE, separator=";")
+    print(f"Saved sweep summary to {SWEEP_SUMMARY_FILE}")
+
+    totals = summary \
+        .group_by(["prediction_threshold", "atlas_prediction_threshold", "month_start", "month_end"]) \
+        .agg([
+            pl.col("new_species").sum(),
+            (pl.col("new_species") > 0).sum().alias("squares_with_new_species")
+        ]) \
+        .sort(["prediction_threshold", "atlas_prediction_threshold", "month_start", "month_end"])
+    print(totals)
+
+
+def main(sweep=False):
     """Main function to process all squares and generate results."""
     # Load atlas squares
     squares_df = pl.read_csv(SQUARES_FILE, separator=";")
@@ -205,15 +354,37 @@ def main():
     # Load bird species lookup
     bird_species_lookup = read_bird_species_lookup()
     
-    # Load and pre-filter observations
-    all_observations = load_and_filter_observations()
+    # Load and pre-filter observations. A sweep loads observations passing the loosest settings,
+    # and stricter settings are evaluated per square.
+    if sweep:
+        sweep_settings = get_sweep_settings()
+        sweep_summaries = []
+        all_observations = load_and_filter_observations(
+            (sweep_settings["month_start"].min(), sweep_settings["month_end"].max()),
+            sweep_settings["prediction_threshold"].min()
+        )
+    else:
+        all_observations = load_and_filter_observations()
+
+    # Sort observations by square, so that each square can be sliced directly
+    with stage("sort_and_index", rows_in=len(all_observations)):
+        all_observations, square_index = sort_and_index(all_observations)
+    print(f"Observations cover {len(square_index)} squares")
     
     # Process squares
     square_count = 0
     for i, square_row in enumerate(squares_df.iter_rows(named=True)):
         print(f"Processing {i+1}/{total_squares}: {square_row['square_name']}")
         
-        filtered_observations = process_square(square_row, all_observations, bird_species_lookup)
+        if sweep:
+            candidates, summary = sweep_square(square_row, all_observations, square_index, bird_species_lookup, sweep_settings)
+            if summary is not None:
+                write_results_to_file(candidates, square_count == 0, SWEEP_CANDIDATES_FILE)
+                sweep_summaries.append(summary)
+                square_count += 1
+            filtered_observations = None
+        else:
+            filtered_observations = process_square(square_row, all_observations, square_index, bird_species_lookup)
         
         if filtered_observations is not None:
             # Write results to file
@@ -227,8 +398,16 @@ def main():
         
         print("--")
 
+    if sweep:
+        write_sweep_summary(sweep_summaries)
+
+    write_run_report("atlas_sweep" if sweep else "atlas")
+
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Find observations of species that would be new for atlas squares.")
+    parser.add_argument("--sweep", action="store_true", help="Count new species for all combinations of the SWEEP_* settings in one pass")
+    args = parser.parse_args()
+    main(args.sweep)
 
 
@@ -0,0 +1,169 @@
+# Script to benchmark the pipeline stages on synthetic data, and record throughput and peak memory of each stage
+
+import argparse
+import csv
+import os
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from helpers.synthetic_data import generate_recording_data, generate_atlas_files
+
+APP_DIR = Path(__file__).parent
+SHAPEFILE_DIR = APP_DIR / "ne_110m_admin_0_countries"
+RESULTS_FILE = Path("./output/benchmark_results.csv")
+
+# Stages in pipeline order: name, script with arguments, input file whose rows are counted for throughput.
+# The join is run with both strategies, the string rec_id join for comparison.
+STAGES = [
+    ("ingest_csv", ["ingest_csv.py"], "species_ids_sample.csv"),
+    ("join_rec_id", ["prepare_recording_data.py", "--join-strategy", "rec_id"], "species_ids_sample.csv"),
+    ("prepare_recording_data", ["prepare_recording_data.py", "--join-strategy", "rec_key"], "species_ids_sample.csv"),
+    ("prepare_ykj", ["prepare_ykj.py"], "observations_sample.parquet"),
+    ("prepare_detections", ["prepare_detections.py"], "observations_sample.parquet"),
+    ("atlas", ["atlas.py"], "observations_ykj_sample.parquet"),
+    ("analyze_heatmap", ["analyze_heatmap.py"], "observations_sample.parquet"),
+    ("analyze_maps", ["analyze_maps.py"], "observations_sample.parquet"),
+]
+
+# Stages that need the Natural Earth shapefile, which is not included in the repository
+MAP_STAGES = ["analyze_heatmap", "analyze_maps"]
+
+RESULT_FIELDS = ["timestamp", "revision", "stage", "rows", "wall_seconds", "cpu_seconds", "rows_per_second", "peak_rss_mb", "return_code"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark pipeline stages on synthetic data.")
+    parser.add_argument("--rows", type=int, default=100_000, help="Number of synthetic species ID rows, e.g. 100000 to 500000000")
+    parser.add_argument("--squares", type=int, default=200, help="Number of atlas squares to generate data for")
+    parser.add_argument("--work-dir", type=Path, default=Path("/tmp/otterate_benchmark"), help="Directory for synthetic data and stage outputs")
+    parser.add_argument("--stages", nargs="+", default=[name for name, _, _ in STAGES], help="Stages to benchmark, in pipeline order")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--reuse-data", action="store_true", help="Reuse synthetic data from a previous run in the work directory")
+    parser.add_argument("--generate-only", action="store_true", help="Only generate synthetic data")
+    return parser.parse_args()
+
+
+def count_rows(file: Path) -> int:
+    """Count data rows of a CSV or Parquet file."""
+    if file.suffix == ".parquet":
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(file).metadata.num_rows
+
+    with open(file, "rb") as f:
+        return sum(1 for _ in f) - 1
+
+
+def get_revision() -> str:
+    """Return the current git revision, or empty string if not available."""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def prepare_work_dir(work_dir: Path, n_rows: int, n_squares: int, seed: int, reuse_data: bool):
+    """Generate synthetic data to the work directory, laid out like /data and the app directory."""
+    data_dir = work_dir / "data"
+    app_dir = work_dir / "app"
+
+    if not reuse_data and work_dir.exists():
+        shutil.rmtree(work_dir)
+
+    data_dir.mkdir(parents=True, exist_ok=True)
+    (app_dir / "output").mkdir(parents=True, exist_ok=True)
+
+    if reuse_data and (data_dir / "species_ids_sample.csv").exists():
+        print("Reusing existing synthetic data")
+        return data_dir, app_dir
+
+    print(f"Generating {n_rows:,} rows of synthetic data to {work_dir}...")
+    counts = generate_recording_data(data_dir / "recordings_anon_sample.csv", data_dir / "species_ids_sample.csv", n_rows, seed=seed)
+    print(f"Generated {counts['recordings']:,} recordings and {counts['species_ids']:,} species IDs")
+
+    generate_atlas_files(app_dir, APP_DIR / "data" / "atlas_squares.csv", n_squares, seed=seed)
+
+    if SHAPEFILE_DIR.exists() and not (app_dir / SHAPEFILE_DIR.name).exists():
+        (app_dir / SHAPEFILE_DIR.name).symlink_to(SHAPEFILE_DIR.resolve())
+
+    return data_dir, app_dir
+
+
+def run_stage(command: list, app_dir: Path, data_dir: Path):
+    """Run a stage script in its own process, returning wall time and the process resource usage."""
+    # Synthetic data is generated as sample files, which all stages read with OTTERATE_SAMPLES
+    env = dict(os.environ, OTTERATE_DATA_DIR=str(data_dir), OTTERATE_SAMPLES="1", MPLBACKEND="Agg")
+
+    start_time = time.perf_counter()
+    script, *script_args = command
+    process = subprocess.Popen([sys.executable, str((APP_DIR / script).resolve())] + script_args, cwd=app_dir, env=env)
+    # wait4 returns resource usage of this child only
+    _, status, usage = os.wait4(process.pid, 0)
+    wall_seconds = time.perf_counter() - start_time
+
+    return wall_seconds, os.waitstatus_to_exitcode(status), usage
+
+
+def write_results(results):
+    """Append benchmark results to the results CSV file."""
+    RESULTS_FILE.parent.mkdir(parents=True, exist_ok=True)
+    is_new_file = not RESULTS_FILE.exists()
+
+    with open(RESULTS_FILE, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS, delimiter=";")
+        if is_new_file:
+            writer.writeheader()
+        writer.writerows(results)
+
+
+def main():
+    args = parse_args()
+    data_dir, app_dir = prepare_work_dir(args.work_dir, args.rows, args.squares, args.seed, args.reuse_data)
+
+    if args.generate_only:
+        return
+
+    timestamp = datetime.now().isoformat(timespec="seconds")
+    revision = get_revision()
+    results = []
+
+    for name, command, input_name in STAGES:
+        if name not in args.stages:
+            continue
+
+        if name in MAP_STAGES and not SHAPEFILE_DIR.exists():
+            print(f"Skipping {name} because {SHAPEFILE_DIR} does not exist")
+            continue
+
+        input_file = data_dir / input_name
+        if not input_file.exists():
+            print(f"Skipping {name} because input {input_file} does not exist")
+            continue
+
+        rows = count_rows(input_file)
+        print(f"Running {name} on {rows:,} rows...")
+        wall_seconds, return_code, usage = run_stage(command, app_dir, data_dir)
+
+        # ru_maxrss is in kilobytes on Linux
+        result = {
+            "timestamp": timestamp,
+            "revision": revision,
+            "stage": name,
+            "rows": rows,
+            "wall_seconds": round(wall_seconds, 3),
+            "cpu_seconds": round(usage.ru_utime + usage.ru_stime, 3),
+            "rows_per_second": round(rows / wall_seconds) if wall_seconds > 0 else 0,
+            "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+            "return_code": return_code,
+        }
+        results.append(result)
+        print(f"{name}: {result['wall_seconds']} s, {result['rows_per_second']:,} rows/s, peak {result['peak_rss_mb']} MB")
+
+    write_results(results)
+    print(f"Saved benchmark results to {RESULTS_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# Script to export observation density as zoomable XYZ PNG tile pyramids: a national layer of all observations and a layer for each species
+
+import json
+import re
+import shutil
+import polars as pl
+from pathlib import Path
+from helpers.config import OBSERVATIONS_FILE
+from helpers.tiles import aggregate_pixels, write_tile_pyramid
+
+input_file = OBSERVATIONS_FILE
+output_dir = Path("./output/tiles")
+
+MIN_ZOOM = 4
+MAX_ZOOM = 10
+
+# National layer uses the same filter as analyze_heatmap.py, species layers the same as analyze_maps.py
+NATIONAL_PREDICTION_THRESHOLD = 0.9
+SPECIES_MONTHS = [5, 6, 7]
+NATIONAL_LAYER = "all"
+
+# Define Finland boundaries
+lat_min = 59.719384
+lat_max = 70.095071
+lon_min = 19.032174
+lon_max = 31.587662
+
+VIEWER_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Otterate observation maps</title>
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css">
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<style>
+html, body, #map { height: 100%; margin: 0; }
+#layer { position: absolute; top: 10px; right: 10px; z-index: 1000; }
+</style>
+</head>
+<body>
+<select id="layer"></select>
+<div id="map"></div>
+<script>
+const map = L.map("map").setView([65, 26], 5);
+L.tileLayer("https://tile.openstreetmap.org/{z}/{x}/{y}.png", {
+    maxZoom: 18,
+    attribution: "&copy; OpenStreetMap contributors"
+}).addTo(map);
+
+let overlay = null;
+const select = document.getElementById("layer");
+
+function showLayer(layer) {
+    if (overlay) {
+        map.removeLayer(overlay);
+    }
+    overlay = L.tileLayer(layer.path + "/{z}/{x}/{y}.png", {
+        minZoom: layer.min_zoom,
+        maxNativeZoom: layer.max_zoom,
+        maxZoom: 18,
+        opacity: 0.8
+    }).addTo(map);
+}
+
+fetch("layers.json").then(response => response.json()).then(layers => {
+    layers.forEach((layer, i) => select.add(new Option(`${layer.name} (${layer.observations} obs)`, i)));
+    select.onchange = () => showLayer(layers[select.value]);
+    showLayer(layers[0]);
+});
+</script>
+</body>
+</html>
+"""
+
+
+def safe_filename(name):
+    # Replace spaces and special characters with underscores
+    return re.sub(r'[^a-zA-Z0-9]', '_', name)
+
+
+def load_observations():
+    """Scan observations with coordinates within Finland."""
+    return pl.scan_parquet(input_file) \
+        .select(["finbif_species", "lat", "lon", "month", "prediction"]) \
+        .drop_nulls(["finbif_species", "lat", "lon"]) \
+        .filter(pl.col("lat").is_between(lat_min, lat_max) & pl.col("lon").is_between(lon_min, lon_max))
+
+
+def export_layer(name, pixels):
+    """Write tile pyramid of a layer and return its entry for the layer list."""
+    layer_dir = safe_filename(name)
+    # Tiles are written only where there are observations, so tiles from earlier data are removed first
+    shutil.rmtree(output_dir / layer_dir, ignore_errors=True)
+    tile_counts = write_tile_pyramid(pixels, MAX_ZOOM, MIN_ZOOM, output_dir / layer_dir)
+    print(f"Wrote {sum(tile_counts.values())} tiles for {name}")
+
+    return {
+        "name": name,
+        "path": layer_dir,
+        "observations": int(pixels["count"].sum()),
+        "min_zoom": MIN_ZOOM,
+        "max_zoom": MAX_ZOOM,
+    }
+
+
+def main():
+    output_dir.mkdir(parents=True, exist_ok=True)
+    observations = load_observations()
+    layers = []
+
+    # National layer
+    print("Exporting national layer...")
+    national_pixels = aggregate_pixels(
+        observations.filter(pl.col("prediction") > NATIONAL_PREDICTION_THRESHOLD), MAX_ZOOM
+    ).collect()
+    layers.append(export_layer(NATIONAL_LAYER, national_pixels))
+
+    # Pixel counts of all species are aggregated in a single pass over the observations
+    print("Aggregating species layers...")
+    species_pixels = aggregate_pixels(
+        observations.filter(pl.col("month").is_in(SPECIES_MONTHS)), MAX_ZOOM, group_column="finbif_species"
+    ).collect()
+
+    for (species,), pixels in sorted(species_pixels.partition_by("finbif_species", as_dict=True, include_key=False).items()):
+        print(f"Exporting {species}")
+        layers.append(export_layer(species, pixels))
+
+    with open(output_dir / "layers.json", "w") as f:
+        json.dump(layers, f, indent=2)
+
+    # Remove layers of species that no longer have observations
+    layer_dirs = {layer["path"] for layer in layers}
+    for path in output_dir.iterdir():
+        if path.is_dir() and path.name not in layer_dirs:
+            print(f"Removing layer {path.name}")
+            shutil.rmtree(path)
+
+    with open(output_dir / "index.html", "w") as f:
+        f.write(VIEWER_HTML)
+
+    print(f"Saved tiles to {output_dir}, browse them e.g. with: python -m http.server -d {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
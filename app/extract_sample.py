@@ -1,35 +1,126 @@
 import polars as pl
 import os
+from helpers.config import DATA_DIR
+from helpers.instrumentation import stage, write_run_report
 
 '''
 This script extracts a sample (head or random) of the data for testing and development.
+
+The sample is taken by recording: first a set of rec_ids is selected, then the rows of these
+recordings are extracted from both species_ids.csv and recordings_anon.csv, so that the sampled
+files join to each other. The files are read in batches, and memory use is bounded by the sample size.
+
+A random sample is a reservoir sample: each rec_id gets a pseudo-random key from a hash of the
+rec_id, and the sample keeps the rec_ids with the smallest keys seen so far. The sample can be
+stratified by species or month, keeping the smallest keys of each stratum.
 '''
 
+RECORDINGS_FILE = "recordings_anon.csv"
+SPECIES_IDS_FILE = "species_ids.csv"
 
-def extract_sample(input_file, output_file, n_rows=100000):
-    """Extract n rows from a CSV file and save to a new file."""
-    random_rows = False
+# "head" takes the first recordings, "random" a random sample of recordings
+SAMPLE_MODE = "head"
 
-    print(f"Processing {input_file}...")
-    df = pl.read_csv(input_file)
+# None, "species" or "month", for random samples. With stratification, STRATUM_SAMPLE_SIZE recordings are sampled
+# from each species or month.
+STRATIFY_BY = None
+
+# Number of recordings, not rows. A recording has several species ID rows, about four in the data so far,
+# so 25000 recordings give about 100000 species ID rows.
+SAMPLE_SIZE = 25000
+STRATUM_SAMPLE_SIZE = 1000
+BATCH_SIZE = 1000000
+SEED = 42
+
+
+def iterate_batches(input_file, columns):
+    """Read selected columns of a CSV file in batches, as strings."""
+    reader = pl.read_csv_batched(
+        input_file,
+        columns=columns,
+        batch_size=BATCH_SIZE,
+        infer_schema_length=0
+    )
+    while True:
+        batches = reader.next_batches(1)
+        if not batches:
+            break
+        yield batches[0]
+
+
+def get_strata_source(data_dir):
+    """Return file and expression for the stratum of each row, based on STRATIFY_BY."""
+    if STRATIFY_BY == "species":
+        return os.path.join(data_dir, SPECIES_IDS_FILE), ["rec_id", "species"], pl.col("species")
+    if STRATIFY_BY == "month":
+        return os.path.join(data_dir, RECORDINGS_FILE), ["rec_id", "date"], pl.col("date").str.slice(5, 2)
+    return os.path.join(data_dir, RECORDINGS_FILE), ["rec_id"], pl.lit("all")
+
+
+def select_head_rec_ids(data_dir, sample_size):
+    """Select rec_ids of the first recordings."""
+    rec_ids = pl.DataFrame(schema={"rec_id": pl.Utf8})
+    for batch in iterate_batches(os.path.join(data_dir, RECORDINGS_FILE), ["rec_id"]):
+        rec_ids = pl.concat([rec_ids, batch]).unique(maintain_order=True).head(sample_size)
+        if len(rec_ids) >= sample_size:
+            break
+    return rec_ids["rec_id"]
 
-    if random_rows:
-        df = df.sample(n=n_rows)
-    else:
-        df = df.head(n_rows)
 
-    df.write_csv(output_file)
-    print(f"Saved {n_rows} rows to {output_file}")
+def select_random_rec_ids(data_dir, sample_size):
+    """Select a reservoir sample of sample_size rec_ids, or sample_size rec_ids per stratum if STRATIFY_BY is set."""
+    input_file, columns, stratum = get_strata_source(data_dir)
+    print(f"Sampling rec_ids from {input_file}...")
+
+    reservoir = pl.DataFrame(schema={"stratum": pl.Utf8, "rec_id": pl.Utf8, "key": pl.UInt64})
+    for batch in iterate_batches(input_file, columns):
+        batch = batch.select([
+            stratum.alias("stratum"),
+            pl.col("rec_id"),
+            pl.col("rec_id").hash(SEED).alias("key"),
+        ])
+
+        # Keep the rows with the smallest keys of each stratum. Keys come from rec_ids, so the same
+        # recording always has the same key, and duplicate rows of a recording are sampled together.
+        reservoir = pl.concat([reservoir, batch]) \
+            .unique(subset=["stratum", "rec_id"]) \
+            .sort("key") \
+            .group_by("stratum", maintain_order=True) \
+            .head(sample_size)
+
+    print(f"Sampled from {reservoir['stratum'].n_unique()} strata")
+    return reservoir["rec_id"].unique()
+
+
+def extract_sample_rows(input_file, output_file, rec_ids):
+    """Stream rows of the sampled recordings from a CSV file to a new file."""
+    print(f"Processing {input_file}...")
+    pl.scan_csv(input_file, infer_schema=False) \
+        .filter(pl.col("rec_id").is_in(rec_ids.implode())) \
+        .sink_csv(output_file)
+
+    row_count = pl.scan_csv(output_file, infer_schema=False).select(pl.len()).collect().item()
+    print(f"Saved {row_count} rows to {output_file}")
 
 
 def main():
-    data_dir = "/data"
-    files = ["species_ids.csv", "recordings_anon.csv"]
-    
-    for file in files:
+    data_dir = DATA_DIR
+
+    with stage("select_rec_ids", detail=SAMPLE_MODE) as record:
+        if SAMPLE_MODE == "head":
+            rec_ids = select_head_rec_ids(data_dir, SAMPLE_SIZE)
+        else:
+            rec_ids = select_random_rec_ids(data_dir, STRATUM_SAMPLE_SIZE if STRATIFY_BY else SAMPLE_SIZE)
+        record["rows_out"] = len(rec_ids)
+    print(f"Selected {len(rec_ids)} recordings")
+
+    for file in [SPECIES_IDS_FILE, RECORDINGS_FILE]:
         input_path = os.path.join(data_dir, file)
         output_path = os.path.join(data_dir, file.replace(".csv", "_sample.csv"))
-        extract_sample(input_path, output_path)
+        with stage("extract_sample_rows", detail=file):
+            extract_sample_rows(input_path, output_path, rec_ids)
+
+    write_run_report("extract_sample")
 
 if __name__ == "__main__":
     main()
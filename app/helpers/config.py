@@ -0,0 +1,17 @@
+import os
+from pathlib import Path
+
+# Directory of the raw and processed data files. Defaults to the /data volume of the
+# Docker setup, and can be overridden e.g. to run the pipeline on synthetic data.
+DATA_DIR = Path(os.environ.get("OTTERATE_DATA_DIR", "/data"))
+
+# Scripts read and write the sample files made by extract_sample.py, e.g. recordings_anon_sample.csv
+# and observations_sample.parquet, instead of the full data files, if OTTERATE_SAMPLES is set to 1.
+USE_SAMPLES = os.environ.get("OTTERATE_SAMPLES", "0") == "1"
+SAMPLE_SUFFIX = "_sample" if USE_SAMPLES else ""
+
+# Analyses read consolidated detections, one row per recording and species (see prepare_detections.py),
+# instead of all species identification rows, if OTTERATE_USE_DETECTIONS is set to 1.
+USE_DETECTIONS = os.environ.get("OTTERATE_USE_DETECTIONS", "0") == "1"
+OBSERVATIONS_FILE = DATA_DIR / f"{'detections' if USE_DETECTIONS else 'observations'}{SAMPLE_SUFFIX}.parquet"
+OBSERVATIONS_YKJ_FILE = DATA_DIR / f"{'detections' if USE_DETECTIONS else 'observations'}_ykj{SAMPLE_SUFFIX}.parquet"
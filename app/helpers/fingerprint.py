@@ -0,0 +1,53 @@
+import hashlib
+import json
+import numpy as np
+import polars as pl
+from pathlib import Path
+from typing import Any, Dict
+
+'''
+Content fingerprints for incremental rendering of maps and charts.
+
+A fingerprint combines the row count and a hash of the rows of the input data of an output file,
+and the render parameters. Fingerprints of rendered files are stored in a manifest file in the
+output directory, and an output is re-rendered only if its fingerprint has changed.
+'''
+
+MANIFEST_FILENAME = "fingerprints.json"
+
+
+def fingerprint_frame(df: pl.DataFrame, params: Dict[str, Any]) -> str:
+    """Return fingerprint of a dataframe and render parameters. Row order does not affect the fingerprint."""
+    row_hashes = np.sort(df.hash_rows(seed=0, seed_1=1, seed_2=2, seed_3=3).to_numpy())
+
+    digest = hashlib.sha256()
+    # Row hashes are not guaranteed to be stable between Polars versions
+    digest.update(json.dumps({
+        "rows": len(df),
+        "columns": df.columns,
+        "polars": pl.__version__,
+        "params": params,
+    }, sort_keys=True, default=str).encode("utf-8"))
+    digest.update(row_hashes.tobytes())
+    return digest.hexdigest()
+
+
+def load_manifest(output_dir: Path) -> Dict[str, str]:
+    """Load fingerprints of rendered files in an output directory."""
+    manifest_file = output_dir / MANIFEST_FILENAME
+    if not manifest_file.exists():
+        return {}
+
+    with open(manifest_file, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(output_dir: Path, manifest: Dict[str, str]):
+    """Save fingerprints of rendered files in an output directory."""
+    with open(output_dir / MANIFEST_FILENAME, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def is_up_to_date(manifest: Dict[str, str], output_file: Path, fingerprint: str) -> bool:
+    """Check whether an output file exists and was rendered from data and parameters with the given fingerprint."""
+    return output_file.exists() and manifest.get(output_file.name) == fingerprint
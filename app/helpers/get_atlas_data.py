@@ -3,6 +3,7 @@ import json
 import time
 from pathlib import Path
 from typing import Dict, Any
+from helpers.instrumentation import stage, count
 
 # Create cache directory if it doesn't exist
 cache_dir = Path("./cache")
@@ -42,11 +43,14 @@ def get_cached_square_data(ykj_n: int, ykj_e: int) -> Dict[str, Any]:
     
     if cache_file.exists():
         print(f"Data already cached for {ykj_n}:{ykj_e}")
+        count("atlas_cache_hit")
         with open(cache_file, "r") as f:
             return json.load(f)
     
     print(f"Fetching data for {ykj_n}:{ykj_e}")
-    data = fetch_square_data(ykj_n, ykj_e)
+    count("atlas_cache_miss")
+    with stage("fetch_square_data", detail=f"{ykj_n}:{ykj_e}"):
+        data = fetch_square_data(ykj_n, ykj_e)
     with open(cache_file, "w") as f:
         json.dump(data, f)
     
@@ -0,0 +1,108 @@
+import csv
+import json
+import resource
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+'''
+Lightweight instrumentation of pipeline stages.
+
+Each stage records wall time, CPU time, rows in and out, and peak RSS of the process at the
+end of the stage. Stages can be nested, sub-steps record the name of their parent stage.
+Counters record events such as cache hits and misses. At the end of a run the stages and
+counters are saved as a JSON and CSV run report.
+'''
+
+REPORT_DIR = Path("./output/run_reports")
+STAGE_FIELDS = ["stage", "parent", "detail", "wall_seconds", "cpu_seconds", "rows_in", "rows_out", "peak_rss_mb"]
+
+_stages: List[Dict[str, Any]] = []
+_counters: Dict[str, int] = {}
+_stage_stack: List[str] = []
+_run_start = time.perf_counter()
+
+
+def get_peak_rss_mb() -> float:
+    """Return peak resident set size of the process so far, in megabytes."""
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+@contextmanager
+def stage(name: str, rows_in: Optional[int] = None, detail: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Record timing and memory of a stage. Set record["rows_out"] inside the block to record output rows."""
+    record = {
+        "stage": name,
+        "parent": _stage_stack[-1] if _stage_stack else None,
+        "detail": detail,
+        "rows_in": rows_in,
+        "rows_out": None,
+    }
+    _stages.append(record)
+    _stage_stack.append(name)
+
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        yield record
+    finally:
+        record["wall_seconds"] = round(time.perf_counter() - start_wall, 4)
+        record["cpu_seconds"] = round(time.process_time() - start_cpu, 4)
+        record["peak_rss_mb"] = get_peak_rss_mb()
+        _stage_stack.pop()
+
+
+def count(name: str, increment: int = 1):
+    """Increment a named counter, e.g. cache hits."""
+    _counters[name] = _counters.get(name, 0) + increment
+
+
+def summarize_stages() -> List[Dict[str, Any]]:
+    """Summarize stages by name: number of calls and total wall and CPU time, slowest first."""
+    summary = {}
+    for record in _stages:
+        if "wall_seconds" not in record:
+            continue
+        entry = summary.setdefault(record["stage"], {"stage": record["stage"], "calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0})
+        entry["calls"] += 1
+        entry["wall_seconds"] += record["wall_seconds"]
+        entry["cpu_seconds"] += record["cpu_seconds"]
+
+    for entry in summary.values():
+        entry["wall_seconds"] = round(entry["wall_seconds"], 4)
+        entry["cpu_seconds"] = round(entry["cpu_seconds"], 4)
+
+    return sorted(summary.values(), key=lambda entry: entry["wall_seconds"], reverse=True)
+
+
+def write_run_report(run_name: str, report_dir: Path = REPORT_DIR) -> Path:
+    """Save stages and counters of this run as JSON, and stages as CSV. Returns path of the JSON report."""
+    report_dir.mkdir(parents=True, exist_ok=True)
+    # Microseconds, so that reports of runs finishing within the same second do not overwrite each other
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    json_file = report_dir / f"{run_name}_{timestamp}.json"
+    csv_file = report_dir / f"{run_name}_{timestamp}.csv"
+
+    report = {
+        "run": run_name,
+        "finished": datetime.now().isoformat(timespec="seconds"),
+        "wall_seconds": round(time.perf_counter() - _run_start, 4),
+        "cpu_seconds": round(time.process_time(), 4),
+        "peak_rss_mb": get_peak_rss_mb(),
+        "counters": _counters,
+        "summary": summarize_stages(),
+        "stages": _stages,
+    }
+    with open(json_file, "w") as f:
+        json.dump(report, f, indent=2)
+
+    with open(csv_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=STAGE_FIELDS, delimiter=";", extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(_stages)
+
+    print(f"Saved run report to {json_file}")
+    return json_file
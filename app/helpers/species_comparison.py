@@ -1,9 +1,11 @@
 # Script that compares species names by this app and FinBIF, and matches synonyms
 
 import polars as pl
+from helpers.config import DATA_DIR
 
-mlk_species_file = "/data/output/mlk_species.csv"
-finbif_species_file = "/data/output/finbif_species.tsv"
+# Run from the app directory with python -m helpers.species_comparison
+mlk_species_file = DATA_DIR / "output" / "mlk_species.csv"
+finbif_species_file = DATA_DIR / "output" / "finbif_species.tsv"
 
 # Read both files with their correct delimiters
 mlk_species_df = pl.read_csv(mlk_species_file, separator=";")
@@ -39,5 +41,5 @@ mlk_species_df = mlk_species_df.with_columns(
 )
 
 # Save the result
-mlk_species_df.write_csv("/data/output/mlk_species_with_finbif.csv", separator=";")
+mlk_species_df.write_csv(DATA_DIR / "output" / "mlk_species_with_finbif.csv", separator=";")
 
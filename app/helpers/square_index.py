@@ -0,0 +1,100 @@
+import json
+import polars as pl
+import pyarrow as pa
+from pathlib import Path
+from typing import Dict, Tuple
+
+'''
+Square-level index over observations.
+
+Observations are sorted by YKJ (n, e) so that each square occupies a contiguous
+row range. The index maps each (n, e) to (offset, row_count), which lets a
+square's observations be sliced directly instead of filtered out of the whole frame.
+'''
+
+SquareIndex = Dict[Tuple[int, int], Tuple[int, int]]
+
+
+def compute_square_offsets(sorted_df: pl.DataFrame) -> SquareIndex:
+    """Compute (offset, row_count) for each (n, e) in a dataframe sorted by n and e."""
+    offsets = sorted_df.select(["n", "e"]) \
+        .with_row_index("offset") \
+        .group_by(["n", "e"], maintain_order=True) \
+        .agg([
+            pl.col("offset").first(),
+            pl.len().alias("row_count")
+        ])
+
+    return {
+        (row["n"], row["e"]): (row["offset"], row["row_count"])
+        for row in offsets.iter_rows(named=True)
+    }
+
+
+def sort_and_index(df: pl.DataFrame) -> Tuple[pl.DataFrame, SquareIndex]:
+    """Sort observations by square and return the sorted dataframe with its index."""
+    sorted_df = df.filter(pl.col("n").is_not_null() & pl.col("e").is_not_null()) \
+        .sort(["n", "e"])
+    return sorted_df, compute_square_offsets(sorted_df)
+
+
+def get_square_slice(sorted_df: pl.DataFrame, square_index: SquareIndex, ykj_n: int, ykj_e: int) -> pl.DataFrame:
+    """Return observations of one square, or an empty dataframe if the square has none."""
+    offset, row_count = square_index.get((ykj_n, ykj_e), (0, 0))
+    return sorted_df.slice(offset, row_count)
+
+
+def get_square_index_files(input_file: Path) -> Tuple[Path, Path]:
+    """Return paths of the square-sorted Arrow IPC file and the square index built from an observations file."""
+    return input_file.with_name(f"{input_file.stem}_sorted.arrow"), input_file.with_name(f"{input_file.stem}_square_index.json")
+
+
+def build_square_index(input_file: Path, sorted_file: Path, index_file: Path) -> SquareIndex:
+    """Sort observations by square into an Arrow IPC file and save the square index as JSON."""
+    df = pl.read_parquet(input_file)
+    sorted_df, square_index = sort_and_index(df)
+
+    # Uncompressed IPC so that the file can be memory-mapped without copying
+    sorted_df.write_ipc(sorted_file, compression="uncompressed")
+
+    with open(index_file, "w") as f:
+        json.dump([
+            {"n": n, "e": e, "offset": offset, "row_count": row_count}
+            for (n, e), (offset, row_count) in square_index.items()
+        ], f)
+
+    return square_index
+
+
+def load_square_index(index_file: Path) -> SquareIndex:
+    """Load square index saved by build_square_index."""
+    with open(index_file, "r") as f:
+        entries = json.load(f)
+
+    return {
+        (entry["n"], entry["e"]): (entry["offset"], entry["row_count"])
+        for entry in entries
+    }
+
+
+def open_sorted_observations(sorted_file: Path) -> pa.Table:
+    """Open the square-sorted Arrow IPC file memory-mapped, without reading it to memory."""
+    source = pa.memory_map(str(sorted_file), "r")
+    return pa.ipc.open_file(source).read_all()
+
+
+def read_square_observations(table: pa.Table, square_index: SquareIndex, ykj_n: int, ykj_e: int) -> pl.DataFrame:
+    """Slice one square's observations from a memory-mapped table."""
+    offset, row_count = square_index.get((ykj_n, ykj_e), (0, 0))
+    return pl.from_arrow(table.slice(offset, row_count))
+
+
+def square_row_counts(square_index: SquareIndex) -> pl.DataFrame:
+    """Return per-square row counts, largest first, for balancing work between workers."""
+    return pl.DataFrame(
+        [
+            {"n": n, "e": e, "row_count": row_count}
+            for (n, e), (_, row_count) in square_index.items()
+        ],
+        schema={"n": pl.Int32, "e": pl.Int32, "row_count": pl.UInt32}
+    ).sort("row_count", descending=True)
@@ -0,0 +1,162 @@
+import json
+import os
+import polars as pl
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+from helpers.config import DATA_DIR
+
+'''
+One-time conversion of the raw CSV inputs into typed, compressed Parquet staging files.
+
+Each CSV file is parsed once with an explicit schema. Later runs read the staging file, which is
+converted again only when the source CSV has changed. Changes are detected from the size and
+modification time of the CSV file, which are saved next to the staging file.
+
+For joining recordings and species IDs, the string rec_id is mapped to a compact integer rec_key,
+and both staging files are written sorted by rec_key. A range of rec_keys can then be read from
+both files without reading the rest of them, using Parquet row group statistics.
+'''
+
+STAGING_DIR = DATA_DIR / "staging"
+
+RECORDINGS_SCHEMA = {
+    "rec_id": pl.Utf8,
+    "user_anon": pl.Utf8,
+    "date": pl.Utf8,
+    "time": pl.Utf8,
+    "rec_type": pl.Utf8,
+    "point_count_loc": pl.Utf8,
+    "lat": pl.Float64,
+    "lon": pl.Float64,
+    "url": pl.Utf8,
+}
+
+SPECIES_IDS_SCHEMA = {
+    "rec_id": pl.Utf8,
+    "result_id": pl.Utf8,
+    "species": pl.Utf8,
+    "prediction": pl.Float64,
+    "orig_prediction": pl.Float64,
+    "feedback": pl.Utf8,
+    "model_version": pl.Utf8,
+    "song_start": pl.Float64,
+    "isseen": pl.Boolean,
+    "isheard": pl.Boolean,
+}
+
+# Sorted files are written in small row groups, so that reading a range of rec_keys skips most of the file
+KEYED_ROW_GROUP_SIZE = 250000
+
+
+def add_date_columns(recordings: pl.LazyFrame) -> pl.LazyFrame:
+    """Add year, month and day columns, parsing the date column once."""
+    parsed_date = pl.col("date").str.to_date("%Y-%m-%d", strict=False)
+    return recordings.with_columns([
+        parsed_date.dt.year().cast(pl.Int32).alias("year"),
+        parsed_date.dt.month().cast(pl.Int32).alias("month"),
+        parsed_date.dt.day().cast(pl.Int32).alias("day"),
+    ])
+
+
+def get_source_state(csv_file: Path) -> Dict[str, int]:
+    """Return size and modification time of a source file."""
+    stat = os.stat(csv_file)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def is_staged(csv_file: Path, parquet_file: Path, state_file: Path) -> bool:
+    """Check whether the staging file exists and was converted from the current version of the CSV file."""
+    if not parquet_file.exists() or not state_file.exists():
+        return False
+
+    with open(state_file, "r") as f:
+        return json.load(f) == get_source_state(csv_file)
+
+
+def ensure_staged(csv_file: Path, schema_overrides: Dict[str, pl.DataType], transform: Optional[Callable[[pl.LazyFrame], pl.LazyFrame]] = None) -> Path:
+    """Convert a CSV file to a typed Parquet staging file, if not already converted. Returns path of the staging file."""
+    csv_file = Path(csv_file)
+    parquet_file = STAGING_DIR / f"{csv_file.stem}.parquet"
+    state_file = STAGING_DIR / f"{csv_file.stem}.source.json"
+
+    if is_staged(csv_file, parquet_file, state_file):
+        print(f"Using staged {parquet_file}")
+        return parquet_file
+
+    print(f"Converting {csv_file} to {parquet_file}...")
+    STAGING_DIR.mkdir(parents=True, exist_ok=True)
+    source_state = get_source_state(csv_file)
+
+    data = pl.scan_csv(csv_file, schema_overrides=schema_overrides)
+    if transform is not None:
+        data = transform(data)
+
+    # Write to a temporary file first, so that an interrupted conversion does not leave a partial staging file
+    temporary_file = parquet_file.with_suffix(".parquet.tmp")
+    data.sink_parquet(temporary_file, compression="zstd")
+    temporary_file.replace(parquet_file)
+
+    with open(state_file, "w") as f:
+        json.dump(source_state, f)
+
+    return parquet_file
+
+
+def stage_recordings(csv_file: Path) -> Path:
+    """Convert recordings CSV to a staging file with parsed year, month and day."""
+    return ensure_staged(csv_file, RECORDINGS_SCHEMA, add_date_columns)
+
+
+def stage_species_ids(csv_file: Path) -> Path:
+    """Convert species IDs CSV to a staging file."""
+    return ensure_staged(csv_file, SPECIES_IDS_SCHEMA)
+
+
+def stage_keyed(recordings_csv: Path, species_ids_csv: Path) -> Tuple[Path, Path, int]:
+    """Stage recordings and species IDs with an integer rec_key, sorted by rec_key, if not already staged.
+
+    Returns paths of the keyed recordings and species IDs files, and the number of rec_keys.
+    """
+    recordings_staged = stage_recordings(recordings_csv)
+    species_ids_staged = stage_species_ids(species_ids_csv)
+
+    stem = Path(recordings_csv).stem
+    keys_file = STAGING_DIR / f"{stem}.rec_keys.parquet"
+    recordings_keyed = STAGING_DIR / f"{stem}.keyed.parquet"
+    species_ids_keyed = STAGING_DIR / f"{Path(species_ids_csv).stem}.keyed.parquet"
+    state_file = STAGING_DIR / f"{stem}.keyed.source.json"
+
+    source_state = {
+        "recordings": get_source_state(recordings_csv),
+        "species_ids": get_source_state(species_ids_csv),
+    }
+    is_current = state_file.exists() and all(file.exists() for file in (keys_file, recordings_keyed, species_ids_keyed))
+    if is_current:
+        with open(state_file, "r") as f:
+            is_current = json.load(f) == source_state
+
+    if not is_current:
+        print("Mapping rec_ids to integer keys...")
+        # rec_ids of both files, so that species IDs without a recording also get a key
+        rec_keys = pl.concat([
+            pl.scan_parquet(recordings_staged).select("rec_id"),
+            pl.scan_parquet(species_ids_staged).select("rec_id"),
+        ]) \
+            .drop_nulls() \
+            .unique() \
+            .sort("rec_id") \
+            .with_row_index("rec_key")
+        rec_keys.sink_parquet(keys_file, compression="zstd")
+
+        for staged_file, keyed_file in ((recordings_staged, recordings_keyed), (species_ids_staged, species_ids_keyed)):
+            print(f"Writing {keyed_file} sorted by rec_key...")
+            pl.scan_parquet(staged_file) \
+                .join(pl.scan_parquet(keys_file), on="rec_id", how="left") \
+                .sort("rec_key") \
+                .sink_parquet(keyed_file, compression="zstd", row_group_size=KEYED_ROW_GROUP_SIZE)
+
+        with open(state_file, "w") as f:
+            json.dump(source_state, f)
+
+    key_count = pl.scan_parquet(keys_file).select(pl.len()).collect().item()
+    return recordings_keyed, species_ids_keyed, key_count
@@ -0,0 +1,219 @@
+import json
+import numpy as np
+import polars as pl
+from pathlib import Path
+from typing import Dict, List, Optional
+
+'''
+Generator for synthetic input data with realistic distributions, for benchmarking and
+development without the real recordings. Produces the same files as the real pipeline input:
+
+- recordings CSV, one row per recording
+- species IDs CSV, one row per species hit in a recording
+- bird_species.tsv, atlas square JSON files (as in the atlas API cache) and atlas prediction JSON files
+
+Rows are generated in chunks, so that the scale (species ID rows) can range from 100k to
+hundreds of millions without holding the data in memory.
+'''
+
+# Finland bounding box
+LAT_MIN = 59.719384
+LAT_MAX = 70.095071
+LON_MIN = 19.032174
+LON_MAX = 31.587662
+
+# Share of recordings per month, most recordings are made during the spring and early summer
+MONTH_WEIGHTS = [0.005, 0.01, 0.03, 0.12, 0.26, 0.26, 0.15, 0.08, 0.05, 0.02, 0.01, 0.005]
+
+# Mean number of additional species per recording and additional hits per species
+EXTRA_SPECIES_MEAN = 0.8
+EXTRA_HITS_MEAN = 1.5
+MEAN_ROWS_PER_RECORDING = (1 + EXTRA_SPECIES_MEAN) * (1 + EXTRA_HITS_MEAN)
+
+SONG_INTERVAL_SECONDS = 3.0
+ATLAS_CLASSES = ["MY.atlasClassEnumA", "MY.atlasClassEnumB", "MY.atlasClassEnumC", "MY.atlasClassEnumD", "MY.atlasClassEnumE"]
+
+SPECIES_LIST_FILE = Path(__file__).parent.parent / "species_list.csv"
+
+
+def read_species_weights(species_list_file: Path = SPECIES_LIST_FILE) -> pl.DataFrame:
+    """Read species list with observation counts, which are used as species weights."""
+    return pl.read_csv(species_list_file, separator=";") \
+        .filter(pl.col("identifier").is_not_null()) \
+        .with_columns((pl.col("count") / pl.col("count").sum()).alias("weight"))
+
+
+def generate_recordings_chunk(rng: np.random.Generator, first_rec: int, n_recordings: int, n_users: int) -> pl.DataFrame:
+    """Generate a chunk of recordings with sequential rec_ids starting from first_rec."""
+    # Users are Zipf distributed: a few users make most of the recordings
+    users = (rng.zipf(1.6, n_recordings) - 1) % n_users
+
+    # Most recordings are from southern Finland
+    lat = LAT_MIN + rng.beta(1.3, 3.0, n_recordings) * (LAT_MAX - LAT_MIN)
+    lon = np.clip(rng.normal(25.0, 2.2, n_recordings), LON_MIN, LON_MAX)
+
+    month = rng.choice(np.arange(1, 13), n_recordings, p=MONTH_WEIGHTS)
+    hour = np.round(rng.normal(5.0, 4.0, n_recordings)).astype(int) % 24
+
+    return pl.DataFrame({
+        "rec_index": np.arange(first_rec, first_rec + n_recordings),
+        "user_index": users,
+        "year": rng.integers(2023, 2026, n_recordings),
+        "month": month,
+        "day": rng.integers(1, 29, n_recordings),
+        "hour": hour,
+        "minute": rng.integers(0, 60, n_recordings),
+        "second": rng.integers(0, 60, n_recordings),
+        "rec_type": rng.choice(["direct", "interval", "point"], n_recordings, p=[0.7, 0.25, 0.05]),
+        "lat": np.round(lat, 5),
+        "lon": np.round(lon, 5),
+        "real_obs": rng.random(n_recordings) < 0.1,
+        "len": rng.integers(1, 7, n_recordings) * 10,
+    }).select([
+        pl.format("rec{}", pl.col("rec_index")).alias("rec_id"),
+        pl.format("user{}", pl.col("user_index")).alias("user_anon"),
+        pl.date("year", "month", "day").cast(pl.Utf8).alias("date"),
+        pl.time("hour", "minute", "second").cast(pl.Utf8).alias("time"),
+        "rec_type",
+        pl.when(pl.col("rec_type") == "point")
+            .then(pl.format("Point {}", pl.col("rec_index") % 500))
+            .otherwise(None)
+            .alias("point_count_loc"),
+        "lat",
+        "lon",
+        pl.format("https://example.org/recordings/rec{}.mp3", pl.col("rec_index")).alias("url"),
+        "real_obs",
+        "len",
+        pl.col("len").cast(pl.Float64).alias("dur"),
+    ])
+
+
+def generate_species_ids_chunk(rng: np.random.Generator, recordings: pl.DataFrame, first_result: int, species: pl.DataFrame) -> pl.DataFrame:
+    """Generate species hits for a chunk of recordings, several hits per species and recording."""
+    n_recordings = len(recordings)
+
+    # Species per recording, weighted by how common the species is
+    species_per_recording = 1 + rng.poisson(EXTRA_SPECIES_MEAN, n_recordings)
+    recording_of_species = np.repeat(np.arange(n_recordings), species_per_recording)
+    species_choice = rng.choice(len(species), len(recording_of_species), p=species["weight"].to_numpy())
+
+    # Hits per species, one row for each song_start
+    hits_per_species = 1 + rng.poisson(EXTRA_HITS_MEAN, len(recording_of_species))
+    row_recording = np.repeat(recording_of_species, hits_per_species)
+    row_species = np.repeat(species_choice, hits_per_species)
+    hit_starts = np.cumsum(hits_per_species) - hits_per_species
+    hit_number = np.arange(len(row_recording)) - np.repeat(hit_starts, hits_per_species)
+    n_rows = len(row_recording)
+
+    # Predictions are skewed towards high confidence
+    prediction = np.round(0.5 + 0.5 * rng.beta(4.0, 1.2, n_rows), 4)
+
+    return pl.DataFrame({
+        "rec_id": recordings["rec_id"].gather(row_recording),
+        "result_index": np.arange(first_result, first_result + n_rows),
+        "species": species["species"].gather(row_species),
+        "prediction": prediction,
+        "orig_prediction": prediction,
+        "song_start": hit_number * SONG_INTERVAL_SECONDS + np.round(rng.random(n_rows) * SONG_INTERVAL_SECONDS, 1),
+        "has_isseen": rng.random(n_rows) < 0.05,
+        "isseen_value": rng.random(n_rows) < 0.5,
+        "has_isheard": rng.random(n_rows) < 0.1,
+    }).select([
+        "rec_id",
+        pl.format("res{}", pl.col("result_index")).alias("result_id"),
+        "species",
+        "prediction",
+        "orig_prediction",
+        pl.lit(None, dtype=pl.Utf8).alias("feedback"),
+        pl.lit("v2.0").alias("model_version"),
+        "song_start",
+        pl.when(pl.col("has_isseen")).then(pl.col("isseen_value")).otherwise(None).alias("isseen"),
+        pl.when(pl.col("has_isheard")).then(True).otherwise(None).alias("isheard"),
+    ])
+
+
+def generate_recording_data(recordings_file: Path, species_ids_file: Path, n_rows: int, chunk_rows: int = 2_000_000, seed: int = 0) -> Dict[str, int]:
+    """Generate recordings and species IDs CSV files with approximately n_rows species ID rows."""
+    rng = np.random.default_rng(seed)
+    species = read_species_weights()
+
+    n_recordings_total = max(1, int(n_rows / MEAN_ROWS_PER_RECORDING))
+    n_users = max(10, n_recordings_total // 200)
+    recordings_per_chunk = max(1, int(chunk_rows / MEAN_ROWS_PER_RECORDING))
+
+    recordings_count = 0
+    species_ids_count = 0
+
+    with open(recordings_file, "w") as recordings_out, open(species_ids_file, "w") as species_ids_out:
+        while recordings_count < n_recordings_total:
+            n_recordings = min(recordings_per_chunk, n_recordings_total - recordings_count)
+            is_first_chunk = recordings_count == 0
+
+            recordings = generate_recordings_chunk(rng, recordings_count, n_recordings, n_users)
+            species_ids = generate_species_ids_chunk(rng, recordings, species_ids_count, species)
+
+            # Recordings are not ordered by rec_id in the real data either
+            recordings.sample(fraction=1.0, shuffle=True, seed=int(rng.integers(2**31))) \
+                .write_csv(recordings_out, include_header=is_first_chunk)
+            species_ids.write_csv(species_ids_out, include_header=is_first_chunk)
+
+            recordings_count += n_recordings
+            species_ids_count += len(species_ids)
+            print(f"Generated {species_ids_count:,} species ID rows")
+
+    return {"recordings": recordings_count, "species_ids": species_ids_count}
+
+
+def generate_atlas_files(app_dir: Path, squares_file: Path, n_squares: Optional[int] = None, seed: int = 0) -> List[str]:
+    """Generate bird species lookup, cached atlas square data and atlas predictions for squares."""
+    rng = np.random.default_rng(seed)
+    species = read_species_weights()
+    identifiers = species["identifier"].to_list()
+    # Scientific names stand in for the Finnish names
+    finnish_names = species["species"].to_list()
+
+    data_dir = app_dir / "data"
+    cache_dir = app_dir / "cache"
+    predictions_dir = data_dir / "atlas_predictions_2024"
+    for directory in (data_dir, cache_dir, predictions_dir):
+        directory.mkdir(parents=True, exist_ok=True)
+
+    with open(data_dir / "bird_species.tsv", "w", encoding="utf-8") as f:
+        f.write("scientific_name\tidentifier\tfinnish_name\n")
+        for scientific_name, identifier in zip(species["species"], identifiers):
+            f.write(f"{scientific_name}\t{identifier}\t{scientific_name}\n")
+
+    squares_df = pl.read_csv(squares_file, separator=";")
+    if n_squares is not None:
+        squares_df = squares_df.sample(n=min(n_squares, len(squares_df)), seed=seed)
+    squares_df.write_csv(data_dir / "atlas_squares.csv", separator=";")
+
+    weights = species["weight"].to_numpy()
+    square_names = []
+    for square in squares_df.iter_rows(named=True):
+        ykj_n, ykj_e = square["ykj_n"], square["ykj_e"]
+
+        # Common species are more likely to be already recorded in the square
+        recorded = rng.random(len(identifiers)) < np.clip(weights * 40, 0.05, 0.95)
+        square_data = {
+            "name": square["square_name"],
+            "activityCategory": {"value": f"MY.atlasActivityCategoryEnum{rng.integers(0, 6)}"},
+            "birdAssociationArea": {"value": f"ML.{rng.integers(1088, 1120)}"},
+            "data": [
+                {"speciesId": identifier, "atlasClass": str(rng.choice(ATLAS_CLASSES))}
+                for identifier, is_recorded in zip(identifiers, recorded) if is_recorded
+            ]
+        }
+        with open(cache_dir / f"{ykj_n}_{ykj_e}.json", "w") as f:
+            json.dump(square_data, f)
+
+        predictions = {
+            finnish_name: {"predictions": [{"value": float(np.round(rng.beta(2.0, 2.0) * 1.2, 2))}]}
+            for finnish_name in finnish_names
+        }
+        with open(predictions_dir / f"{ykj_n}_{ykj_e}.json", "w") as f:
+            json.dump(predictions, f)
+
+        square_names.append(square["square_name"])
+
+    return square_names
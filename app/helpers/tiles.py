@@ -0,0 +1,98 @@
+import math
+import numpy as np
+import polars as pl
+import matplotlib.pyplot as plt
+from matplotlib.colors import LogNorm
+from pathlib import Path
+from typing import Dict, List, Optional
+
+'''
+Helpers for exporting observation density as XYZ (Web Mercator) PNG tile pyramids.
+
+Observations are aggregated to pixel counts at the most detailed zoom level once. Each coarser
+zoom level is built from the counts of the next finer level, by summing 2x2 pixel blocks, so the
+observations are read only once per layer. Tiles are written only where there are observations.
+'''
+
+TILE_SIZE = 256
+CMAP = "inferno_r"
+
+
+def pixel_columns(zoom: int) -> List[pl.Expr]:
+    """Return Polars expressions for global pixel coordinates (x, y) of lon and lat at a zoom level."""
+    world_size = TILE_SIZE * 2 ** zoom
+    lat_radians = pl.col("lat").radians()
+
+    return [
+        ((pl.col("lon") + 180) / 360 * world_size).floor().cast(pl.Int64).alias("x"),
+        ((1 - (lat_radians.tan() + 1 / lat_radians.cos()).log() / math.pi) / 2 * world_size).floor().cast(pl.Int64).alias("y"),
+    ]
+
+
+def aggregate_pixels(observations: pl.LazyFrame, zoom: int, group_column: Optional[str] = None) -> pl.LazyFrame:
+    """Count observations per pixel at a zoom level, optionally per group such as species."""
+    keys = ([group_column] if group_column else []) + ["x", "y"]
+    return observations \
+        .with_columns(pixel_columns(zoom)) \
+        .group_by(keys) \
+        .agg(pl.len().cast(pl.Int64).alias("count"))
+
+
+def downsample_pixels(pixels: pl.DataFrame) -> pl.DataFrame:
+    """Aggregate pixel counts to the next coarser zoom level."""
+    return pixels \
+        .with_columns([
+            (pl.col("x") // 2).alias("x"),
+            (pl.col("y") // 2).alias("y"),
+        ]) \
+        .group_by(["x", "y"]) \
+        .agg(pl.col("count").sum())
+
+
+def render_tile(tile_pixels: pl.DataFrame, tile_x: int, tile_y: int, norm: LogNorm, colors: np.ndarray) -> np.ndarray:
+    """Render pixel counts of one tile to an RGBA image, transparent where there are no observations."""
+    rows = tile_pixels["y"].to_numpy() - tile_y * TILE_SIZE
+    columns = tile_pixels["x"].to_numpy() - tile_x * TILE_SIZE
+    color_index = np.clip(norm(tile_pixels["count"].to_numpy()) * 255, 0, 255).astype(np.uint8)
+
+    # Only pixels with observations are coloured, using a colour lookup table
+    image = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+    image[rows, columns] = colors[color_index]
+    return image
+
+
+def write_zoom_level(pixels: pl.DataFrame, zoom: int, output_dir: Path) -> int:
+    """Write tiles of one zoom level that contain observations. Returns the number of tiles written."""
+    if pixels.is_empty():
+        return 0
+
+    norm = LogNorm(vmin=1, vmax=max(pixels["count"].max(), 2))
+    colors = plt.get_cmap(CMAP)(np.linspace(0, 1, 256), bytes=True)
+    tiles = pixels \
+        .with_columns([
+            (pl.col("x") // TILE_SIZE).alias("tile_x"),
+            (pl.col("y") // TILE_SIZE).alias("tile_y"),
+        ]) \
+        .partition_by(["tile_x", "tile_y"], as_dict=True)
+
+    for (tile_x, tile_y), tile_pixels in tiles.items():
+        tile_file = output_dir / str(zoom) / str(tile_x) / f"{tile_y}.png"
+        tile_file.parent.mkdir(parents=True, exist_ok=True)
+        plt.imsave(tile_file, render_tile(tile_pixels, tile_x, tile_y, norm, colors))
+
+    return len(tiles)
+
+
+def write_tile_pyramid(pixels: pl.DataFrame, max_zoom: int, min_zoom: int, output_dir: Path) -> Dict[int, int]:
+    """Write tiles from max_zoom down to min_zoom, from pixel counts at max_zoom. Returns tile counts per zoom level."""
+    # A layer without observations has no tiles
+    if pixels.is_empty():
+        return {}
+
+    tile_counts = {}
+    for zoom in range(max_zoom, min_zoom - 1, -1):
+        tile_counts[zoom] = write_zoom_level(pixels, zoom, output_dir)
+        if zoom > min_zoom:
+            pixels = downsample_pixels(pixels)
+
+    return tile_counts
@@ -0,0 +1,11 @@
+# Script to convert the raw CSV files to typed, compressed Parquet staging files, which prepare_recording_data.py reads instead of the CSV files
+
+from helpers.config import DATA_DIR
+from helpers.staging import stage_keyed
+
+# Recordings and species IDs are staged in pairs, with rec_ids mapped to integer keys shared by both files
+for suffix in ["", "_sample"]:
+    recordings_file = DATA_DIR / f"recordings_anon{suffix}.csv"
+    species_ids_file = DATA_DIR / f"species_ids{suffix}.csv"
+    if recordings_file.exists() and species_ids_file.exists():
+        stage_keyed(recordings_file, species_ids_file)
@@ -0,0 +1,356 @@
+# Script to run the pipeline stages in dependency order, in parallel where possible, skipping stages that are up to date
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+from typing import Dict, List, Optional
+from helpers.config import DATA_DIR
+
+'''
+Each stage is a script run in its own process, declared with the files it reads and writes. A stage
+depends on the stages that write its inputs, and runs when they have finished. Stages that do not
+depend on each other run in parallel.
+
+A stage is skipped if its outputs exist and its inputs, including the script and helpers/*.py, have not changed
+since it last ran successfully. Changes are detected from the size and modification time of the
+files, or from a hash of their contents with --check hash. The state is saved in .pipeline_state.json
+in the data directory.
+
+This script only uses the standard library, so that heavy libraries are imported only by the stages
+that need them.
+'''
+
+APP_DIR = Path(__file__).parent
+STATE_FILENAME = ".pipeline_state.json"
+LOG_DIR = APP_DIR / "output" / "pipeline_logs"
+
+DEFAULT_JOBS = 2
+
+
+def declare_stage(script: str, inputs: List[Path], outputs: List[Path], command: Optional[List[str]] = None) -> Dict:
+    """Declare a stage run with a script. Changes to the script or the helper modules also cause the stage to run."""
+    # Source files only, as compiled files in __pycache__ are rewritten when stages import the helpers
+    code_files = [APP_DIR / script] + [path for path in sorted((APP_DIR / "helpers").glob("*.py")) if path != APP_DIR / script]
+    return {
+        "command": command or [script],
+        "inputs": code_files + inputs,
+        "outputs": outputs,
+    }
+
+
+def declare_stages(data_dir: Path, samples: bool, detections: bool) -> Dict[str, Dict]:
+    """Declare pipeline stages with their inputs and outputs, in pipeline order."""
+    suffix = "_sample" if samples else ""
+    observations = data_dir / f"observations{suffix}.parquet"
+    observations_ykj = data_dir / f"observations_ykj{suffix}.parquet"
+    detections_file = data_dir / f"detections{suffix}.parquet"
+    detections_ykj = data_dir / f"detections_ykj{suffix}.parquet"
+
+    # Analyses read the same files as set in helpers/config.py
+    analysis_input = detections_file if detections else observations
+    analysis_ykj_input = detections_ykj if detections else observations_ykj
+
+    shapefile_dir = APP_DIR / "ne_110m_admin_0_countries"
+    output_dir = APP_DIR / "output"
+
+    stages = {}
+    if samples:
+        stages["extract_sample"] = declare_stage(
+            "extract_sample.py",
+            [data_dir / "recordings_anon.csv", data_dir / "species_ids.csv"],
+            [data_dir / "recordings_anon_sample.csv", data_dir / "species_ids_sample.csv"]
+        )
+
+    stages["prepare_recording_data"] = declare_stage(
+        "prepare_recording_data.py",
+        [data_dir / f"recordings_anon{suffix}.csv", data_dir / f"species_ids{suffix}.csv", APP_DIR / "species_list.csv"],
+        [observations]
+    )
+    stages["prepare_ykj"] = declare_stage("prepare_ykj.py", [observations], [observations_ykj])
+
+    if detections:
+        stages["prepare_detections"] = declare_stage(
+            "prepare_detections.py",
+            [observations, observations_ykj],
+            [detections_file, detections_ykj]
+        )
+
+    # Same file names as get_square_index_files in helpers/square_index.py, which is not imported to keep startup fast
+    stages["prepare_square_index"] = declare_stage(
+        "prepare_square_index.py",
+        [analysis_ykj_input],
+        [analysis_ykj_input.with_name(f"{analysis_ykj_input.stem}_sorted.arrow"), analysis_ykj_input.with_name(f"{analysis_ykj_input.stem}_square_index.json")]
+    )
+    stages["atlas"] = declare_stage(
+        "atlas.py",
+        [analysis_ykj_input, APP_DIR / "data" / "atlas_squares.csv", APP_DIR / "data" / "atlas_predictions_2024", APP_DIR / "data" / "bird_species.tsv"],
+        [output_dir / "atlas_results.csv"]
+    )
+    stages["analyze_data"] = declare_stage(
+        "analyze_data.py",
+        [analysis_input],
+        [output_dir / "species_counts_0.9.csv", output_dir / "prediction_histogram.png"]
+    )
+    stages["analyze_heatmap"] = declare_stage(
+        "analyze_heatmap.py",
+        [analysis_input, shapefile_dir],
+        # The manifest is saved on every run, also when the heatmap is up to date and not rendered again
+        [output_dir / "fingerprints.json"]
+    )
+    stages["analyze_maps"] = declare_stage(
+        "analyze_maps.py",
+        [analysis_input, shapefile_dir],
+        # The manifest is saved on every run, also when all maps are up to date
+        [output_dir / "maps" / "fingerprints.json"]
+    )
+    stages["analyze_months"] = declare_stage(
+        "analyze_months.py",
+        [analysis_input],
+        [data_dir / "output" / "monthly_counts.csv"]
+    )
+    stages["export_tiles"] = declare_stage(
+        "export_tiles.py",
+        [analysis_input],
+        [output_dir / "tiles" / "layers.json"]
+    )
+    stages["species_comparison"] = declare_stage(
+        "helpers/species_comparison.py",
+        [data_dir / "output" / "mlk_species.csv", data_dir / "output" / "finbif_species.tsv"],
+        [data_dir / "output" / "mlk_species_with_finbif.csv"],
+        command=["-m", "helpers.species_comparison"]
+    )
+    return stages
+
+
+def get_dependencies(stages: Dict[str, Dict]) -> Dict[str, List[str]]:
+    """Return the stages that write the inputs of each stage."""
+    return {
+        name: [
+            other for other, other_stage in stages.items()
+            if other != name and set(other_stage["outputs"]) & set(stage["inputs"])
+        ]
+        for name, stage in stages.items()
+    }
+
+
+def select_stages(stages: Dict[str, Dict], dependencies: Dict[str, List[str]], targets: List[str]) -> Dict[str, Dict]:
+    """Select target stages and the stages they depend on, keeping pipeline order."""
+    selected = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in selected:
+            selected.add(name)
+            pending.extend(dependencies[name])
+    return {name: stage for name, stage in stages.items() if name in selected}
+
+
+def get_file_state(path: Path, check: str):
+    """Return state of a file or directory for detecting changes, or None if it does not exist."""
+    if not path.exists():
+        return None
+
+    if path.is_dir():
+        files = [(str(file.relative_to(path)), file) for file in sorted(path.rglob("*")) if file.is_file()]
+    else:
+        files = [(path.name, path)]
+
+    if check == "mtime":
+        return [[name, file.stat().st_size, file.stat().st_mtime_ns] for name, file in files]
+
+    digest = hashlib.sha256()
+    for name, file in files:
+        digest.update(name.encode("utf-8"))
+        with open(file, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_input_state(stage: Dict, check: str) -> Dict:
+    """Return state of the inputs of a stage."""
+    return {
+        "check": check,
+        "inputs": {str(path): get_file_state(path, check) for path in stage["inputs"]},
+    }
+
+
+def load_state(state_file: Path) -> Dict:
+    """Load input states of stages from their last successful run."""
+    if not state_file.exists():
+        return {}
+
+    with open(state_file, "r") as f:
+        return json.load(f)
+
+
+def save_state(state_file: Path, state: Dict):
+    """Save input states of stages, writing a temporary file first."""
+    temporary_file = state_file.with_suffix(".tmp")
+    with open(temporary_file, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    temporary_file.replace(state_file)
+
+
+def is_up_to_date(stage: Dict, input_state: Dict, saved_state: Optional[Dict]) -> bool:
+    """Check whether a stage has run with the current inputs, and its outputs exist."""
+    return saved_state == input_state and all(path.exists() for path in stage["outputs"])
+
+
+def get_missing_inputs(stage: Dict) -> List[Path]:
+    """Return inputs of a stage that do not exist."""
+    return [path for path in stage["inputs"] if not path.exists()]
+
+
+def get_stale_outputs(stage: Dict, start_time: float) -> List[Path]:
+    """Return outputs of a stage that do not exist or were not written after the stage started."""
+    # Compared in whole seconds, as some file systems store modification times at that precision
+    return [
+        path for path in stage["outputs"]
+        if not path.exists() or path.stat().st_mtime < int(start_time)
+    ]
+
+
+def run_stage(name: str, stage: Dict, env: Dict[str, str]) -> int:
+    """Run a stage in its own process, writing its output to a log file. Returns the exit code."""
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+    with open(LOG_DIR / f"{name}.log", "w") as log:
+        process = subprocess.run([sys.executable] + stage["command"], cwd=APP_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return process.returncode
+
+
+def run_pipeline(stages: Dict[str, Dict], dependencies: Dict[str, List[str]], env: Dict[str, str], state_file: Path, check: str, jobs: int, force: bool, dry_run: bool) -> Dict[str, str]:
+    """Run stages when their dependencies have finished. Returns the result of each stage."""
+    state = load_state(state_file)
+    results = {}
+    running = {}
+    start_times = {}
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while len(results) < len(stages):
+            for name, stage in stages.items():
+                if name in results or name in running or len(running) >= jobs:
+                    continue
+
+                stage_dependencies = [dependency for dependency in dependencies[name] if dependency in stages]
+                if any(dependency not in results for dependency in stage_dependencies):
+                    continue
+
+                # A skipped dependency is not an error, e.g. samples may have been extracted earlier.
+                # Its outputs are checked below with the other inputs.
+                if any(results[dependency] == "failed" for dependency in stage_dependencies):
+                    results[name] = "skipped"
+                    print(f"{name}: skipped, a stage it depends on failed")
+                    continue
+
+                # In a dry run, dependencies that would run have not written their outputs yet
+                if dry_run and any(results[dependency] == "would run" for dependency in stage_dependencies):
+                    results[name] = "would run"
+                    print(f"{name}: would run after {', '.join(stage_dependencies)}")
+                    continue
+
+                missing_inputs = get_missing_inputs(stage)
+                if missing_inputs:
+                    results[name] = "skipped"
+                    print(f"{name}: skipped, missing input {missing_inputs[0]}")
+                    continue
+
+                input_state = get_input_state(stage, check)
+                if not force and is_up_to_date(stage, input_state, state.get(name)):
+                    results[name] = "up to date"
+                    print(f"{name}: up to date")
+                    continue
+
+                if dry_run:
+                    results[name] = "would run"
+                    print(f"{name}: would run")
+                    continue
+
+                print(f"{name}: running, log in {LOG_DIR / f'{name}.log'}")
+                start_times[name] = time.time()
+                running[name] = (executor.submit(run_stage, name, stage, env), input_state)
+
+            if not running:
+                continue
+
+            finished, _ = wait([future for future, _ in running.values()], return_when=FIRST_COMPLETED)
+            for name in [name for name, (future, _) in running.items() if future in finished]:
+                future, input_state = running.pop(name)
+                elapsed = time.time() - start_times[name]
+                return_code = future.result()
+                stale_outputs = get_stale_outputs(stages[name], start_times[name]) if return_code == 0 else []
+                if return_code != 0:
+                    results[name] = "failed"
+                    print(f"{name}: failed with exit code {return_code} after {elapsed:.1f} s, see {LOG_DIR / f'{name}.log'}")
+                elif stale_outputs:
+                    # State is not saved, so that the stage runs again next time
+                    results[name] = "failed"
+                    print(f"{name}: finished in {elapsed:.1f} s but did not write {stale_outputs[0]}, see {LOG_DIR / f'{name}.log'}")
+                else:
+                    results[name] = "ran"
+                    # Saved after each stage, so that finished stages are skipped if a later stage fails
+                    state[name] = input_state
+                    save_state(state_file, state)
+                    print(f"{name}: finished in {elapsed:.1f} s")
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run pipeline stages in dependency order, skipping stages that are up to date.")
+    parser.add_argument("stages", nargs="*", help="Stages to run, with the stages they depend on. Default is all stages.")
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR, help="Directory of the data files")
+    parser.add_argument("--samples", action="store_true", help="Extract and process sample files instead of the full data files")
+    parser.add_argument("--detections", action="store_true", help="Consolidate observations to detections, and analyse the detections")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_JOBS, help="Number of stages to run in parallel")
+    parser.add_argument("--check", choices=["mtime", "hash"], default="mtime", help="Detect changed inputs by size and modification time, or by content hash")
+    parser.add_argument("--force", action="store_true", help="Run stages even if they are up to date")
+    parser.add_argument("--dry-run", action="store_true", help="Show which stages would run, without running them")
+    parser.add_argument("--list", action="store_true", help="List stages with their inputs and outputs")
+    args = parser.parse_args()
+
+    data_dir = args.data_dir.resolve()
+    stages = declare_stages(data_dir, args.samples, args.detections)
+    dependencies = get_dependencies(stages)
+
+    if args.list:
+        for name, stage in stages.items():
+            print(f"{name} (after: {', '.join(dependencies[name]) or '-'})")
+            print(f"  inputs: {', '.join(str(path) for path in stage['inputs'])}")
+            print(f"  outputs: {', '.join(str(path) for path in stage['outputs'])}")
+        return
+
+    unknown_stages = [name for name in args.stages if name not in stages]
+    if unknown_stages:
+        parser.error(f"Unknown stages: {', '.join(unknown_stages)}. Stages are: {', '.join(stages)}")
+    if args.stages:
+        stages = select_stages(stages, dependencies, args.stages)
+
+    env = dict(
+        os.environ,
+        OTTERATE_DATA_DIR=str(data_dir),
+        OTTERATE_SAMPLES="1" if args.samples else "0",
+        OTTERATE_USE_DETECTIONS="1" if args.detections else "0",
+        MPLBACKEND="Agg"
+    )
+
+    start_time = time.perf_counter()
+    results = run_pipeline(stages, dependencies, env, data_dir / STATE_FILENAME, args.check, args.jobs, args.force, args.dry_run)
+    print(f"Pipeline finished in {time.perf_counter() - start_time:.1f} s: " + ", ".join(
+        f"{sum(1 for result in results.values() if result == status)} {status}"
+        for status in ("ran", "up to date", "would run", "skipped", "failed")
+        if status in results.values()
+    ))
+
+    if "failed" in results.values():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# Script to consolidate observations to detections: one row per recording and species, instead of one row per song hit
+
+import polars as pl
+from helpers.config import DATA_DIR, SAMPLE_SUFFIX
+from helpers.instrumentation import stage, write_run_report
+
+'''
+A recording has a row for each time a species was identified in it, with the start time of the song
+in song_start. Most analyses only need to know that a species was detected in a recording, so this
+script collapses these rows into one detection per recording and species. The detection keeps all
+columns of the row with the highest prediction, and adds:
+
+'first_song_start', Float64, start time of the first song of the species in the recording
+'last_song_start', Float64, start time of the last song of the species in the recording
+'hit_count', UInt32, number of identifications of the species in the recording
+
+Analyses read the detections instead of the observations, if environment variable
+OTTERATE_USE_DETECTIONS is set to 1.
+'''
+
+# Observation files and the detection files they are consolidated to
+DETECTION_FILES = [
+    (DATA_DIR / f"observations{SAMPLE_SUFFIX}.parquet", DATA_DIR / f"detections{SAMPLE_SUFFIX}.parquet"),
+    (DATA_DIR / f"observations_ykj{SAMPLE_SUFFIX}.parquet", DATA_DIR / f"detections_ykj{SAMPLE_SUFFIX}.parquet"),
+]
+
+
+def consolidate_detections(observations: pl.LazyFrame) -> pl.LazyFrame:
+    """Collapse observations to one row per recording and species, keeping the row with the highest prediction."""
+    columns = observations.collect_schema().names()
+
+    detections = observations \
+        .group_by(["rec_id", "species"]) \
+        .agg([
+            pl.all().get(pl.col("prediction").arg_max()),
+            pl.col("song_start").min().alias("first_song_start"),
+            pl.col("song_start").max().alias("last_song_start"),
+            pl.len().alias("hit_count"),
+        ])
+
+    # Keep the column order of the observations
+    return detections.select(columns + ["first_song_start", "last_song_start", "hit_count"])
+
+
+def main():
+    for observations_file, detections_file in DETECTION_FILES:
+        if not observations_file.exists():
+            print(f"Skipping {observations_file}, file does not exist")
+            continue
+
+        print(f"Consolidating {observations_file} to {detections_file}...")
+        with stage("consolidate_detections", detail=observations_file.name) as record:
+            observations = pl.scan_parquet(observations_file)
+            record["rows_in"] = observations.select(pl.len()).collect().item()
+
+            consolidate_detections(observations).sink_parquet(detections_file)
+            record["rows_out"] = pl.scan_parquet(detections_file).select(pl.len()).collect().item()
+
+        print(f"Saved {record['rows_out']} detections from {record['rows_in']} observations to {detections_file}")
+
+    write_run_report("prepare_detections")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,117 @@
+import argparse
+import sys
 import polars as pl
+import pyarrow.parquet as pq
 from pathlib import Path
 import time
+from helpers.config import DATA_DIR, USE_SAMPLES
+from helpers.instrumentation import stage, write_run_report
+from helpers.staging import stage_recordings, stage_species_ids, stage_keyed
+
+# "rec_key" joins integer-keyed, sorted staging files one rec_key range at a time, with bounded memory.
+# "rec_id" joins the whole tables on the string rec_id.
+JOIN_STRATEGY = "rec_key"
+
+# Number of recordings joined at a time with the rec_key strategy
+JOIN_PARTITION_KEYS = 250000
+
+
+def select_recordings(recordings_df):
+    # Remove unneeded columns
+    return recordings_df.drop(["real_obs", "len", "dur"])
+
+
+def select_species_ids(species_ids_df):
+    # Remove unneeded columns and filter before materializing
+    species_ids_df = species_ids_df.drop(["orig_prediction", "feedback", "model_version"])
+    return species_ids_df.filter(pl.col("prediction") >= 0.7)
+
+
+def add_species_information(joined_df, finbif_species_df):
+    # Add FinBIF species information using a join instead of map_elements
+    # Convert finbif_species_df to lazy for better performance
+    finbif_species_lazy = pl.LazyFrame(finbif_species_df)
+    # Join with the species information
+    joined_df = joined_df.join(
+        finbif_species_lazy.select(["species", "finbif_species", "identifier"]),
+        on="species",
+        how="left"
+    )
+
+    # Recast year, month, and day to ensure they're Int32 before writing
+    return joined_df.with_columns([
+        pl.col("year").cast(pl.Int32),
+        pl.col("month").cast(pl.Int32),
+        pl.col("day").cast(pl.Int32)
+    ])
+
+
+def join_by_rec_id(input_recordings_file, input_identifications_file, finbif_species_df, output_file):
+    """Join the whole recordings and species IDs tables on the string rec_id."""
+    # Convert CSV files to typed Parquet staging files, if they have changed since last conversion
+    with stage("staging"):
+        staged_recordings_file = stage_recordings(input_recordings_file)
+        staged_identifications_file = stage_species_ids(input_identifications_file)
+
+    # Recordings and species IDs - using lazy evaluation. Staging file has year, month and day parsed from date.
+    recordings_df = select_recordings(pl.scan_parquet(staged_recordings_file))
+    species_ids_df = select_species_ids(pl.scan_parquet(staged_identifications_file))
+
+    print("Joining datasets...")
+    joined_df = recordings_df.join(species_ids_df, on="rec_id", how="right")
+    joined_df = add_species_information(joined_df, finbif_species_df)
+
+    # Materialize and save in chunks. The lazy query runs here, so this stage covers reading and joining.
+    print("Saving to parquet...")
+    with stage("join_and_sink_parquet") as record:
+        joined_df.sink_parquet(output_file)
+        record["rows_out"] = pl.scan_parquet(output_file).select(pl.len()).collect().item()
+
+
+def join_by_rec_key(input_recordings_file, input_identifications_file, finbif_species_df, output_file):
+    """Join recordings and species IDs on the integer rec_key, one range of rec_keys at a time."""
+    # Convert CSV files to typed Parquet staging files sorted by rec_key, if they have changed since last conversion
+    with stage("staging"):
+        keyed_recordings_file, keyed_identifications_file, key_count = stage_keyed(input_recordings_file, input_identifications_file)
+
+    # Files are sorted by rec_key, so the filter of a partition reads only its row groups
+    partitions = [
+        (str(partition_start), pl.col("rec_key").is_between(partition_start, partition_start + JOIN_PARTITION_KEYS, closed="left"))
+        for partition_start in range(0, max(key_count, 1), JOIN_PARTITION_KEYS)
+    ]
+    # Rows without rec_id have no rec_key. Species IDs without rec_id are kept without recording data, as in the rec_id join.
+    partitions.append(("null", pl.col("rec_key").is_null()))
+
+    print(f"Joining datasets in partitions of {JOIN_PARTITION_KEYS} recordings...")
+    writer = None
+    try:
+        for partition_name, in_partition in partitions:
+            with stage("join_partition", detail=partition_name) as record:
+                recordings_df = select_recordings(pl.scan_parquet(keyed_recordings_file).filter(in_partition)).drop("rec_id")
+                species_ids_df = select_species_ids(pl.scan_parquet(keyed_identifications_file).filter(in_partition))
 
-def process_recordings_data():
+                joined_df = recordings_df.join(species_ids_df, on="rec_key", how="right")
+                # rec_key is only used for joining, so that both strategies write the same columns
+                partition = add_species_information(joined_df, finbif_species_df).drop("rec_key").collect().to_arrow()
+                record["rows_out"] = partition.num_rows
+
+                if writer is None:
+                    writer = pq.ParquetWriter(output_file, partition.schema)
+                writer.write_table(partition)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def process_recordings_data(join_strategy=JOIN_STRATEGY):
     pl.Config.set_tbl_width_chars(2000)     # Large enough to fit all columns
     pl.Config.set_tbl_cols(None)            # Disable column truncation
     pl.Config.set_tbl_rows(100)             # Show up to 100 rows
 
-    handle_samples = True
+    handle_samples = USE_SAMPLES
 
     # Define input and output paths
-    data_dir = Path("/data")
+    data_dir = DATA_DIR
     input_recordings_file = data_dir / "recordings_anon_sample.csv" if handle_samples else data_dir / "recordings_anon.csv"
     input_identifications_file = data_dir / "species_ids_sample.csv" if handle_samples else data_dir / "species_ids.csv"
     output_file = data_dir / "observations_sample.parquet" if handle_samples else data_dir / "observations.parquet"
@@ -21,62 +122,12 @@ def process_recordings_data():
 
     try:
         start_time = time.time()
-        print("Starting data processing...")
-
-        # 1) Recordings - using lazy evaluation
-        print("Processing recordings data...")
-        recordings_df = pl.scan_csv(input_recordings_file)
-
-        # Remove unneeded columns
-        recordings_df = recordings_df.drop(["real_obs", "len", "dur"])
-
-        # Add columns for year, month and day, by splitting date column, as integers
-        recordings_df = recordings_df.with_columns([
-            pl.col("date").str.split("-").list.get(0).cast(pl.Int32).alias("year"),
-            pl.col("date").str.split("-").list.get(1).cast(pl.Int32).alias("month"),
-            pl.col("date").str.split("-").list.get(2).cast(pl.Int32).alias("day")
-        ])
-
-        # 2) Species IDs - using lazy evaluation
-        print("Processing species IDs data...")
-        species_ids_df = pl.scan_csv(input_identifications_file)
-        
-        # Remove unneeded columns and filter before materializing
-        species_ids_df = species_ids_df.drop(["orig_prediction", "feedback", "model_version"])
-        species_ids_df = species_ids_df.filter(pl.col("prediction") >= 0.7)
-
-        # 3) Join dataframes using rec_id field
-        print("Joining datasets...")
-        joined_df = recordings_df.join(species_ids_df, on="rec_id", how="right")
-
-        # 4) Add FinBIF species information using a join instead of map_elements
-        print("Adding FinBIF species information...")
-        # Convert finbif_species_df to lazy for better performance
-        finbif_species_lazy = pl.LazyFrame(finbif_species_df)
-        # Join with the species information
-        joined_df = joined_df.join(
-            finbif_species_lazy.select(["species", "finbif_species", "identifier"]),
-            on="species",
-            how="left"
-        )
-
-        # Recast year, month, and day to ensure they're Int32 before writing
-        # Doesn't work, values are still floats, but they are integers in the data
-        #joined_df = joined_df.with_columns([
-        #    pl.col("year").cast(pl.Int32),
-        #    pl.col("month").cast(pl.Int32),
-        #    pl.col("day").cast(pl.Int32)
-        #])
-
-        joined_df = joined_df.with_columns([
-            pl.col("year").cast(pl.Int32),
-            pl.col("month").cast(pl.Int32),
-            pl.col("day").cast(pl.Int32)
-        ])
-
-        # Materialize and save in chunks
-        print("Saving to parquet...")
-        joined_df.sink_parquet(output_file)
+        print(f"Starting data processing, joining by {join_strategy}...")
+
+        if join_strategy == "rec_key":
+            join_by_rec_key(input_recordings_file, input_identifications_file, finbif_species_df, output_file)
+        else:
+            join_by_rec_id(input_recordings_file, input_identifications_file, finbif_species_df, output_file)
 
         end_time = time.time()
         print(f"Successfully processed data and saved to {output_file}")
@@ -84,6 +135,13 @@ def process_recordings_data():
 
     except Exception as e:
         print(f"Error processing data: {str(e)}")
+        # Non-zero exit code, so that the pipeline and benchmark see the stage as failed
+        sys.exit(1)
+    finally:
+        write_run_report("prepare_recording_data")
 
 if __name__ == "__main__":
-    process_recordings_data()
+    parser = argparse.ArgumentParser(description="Join recordings and species IDs to an observations Parquet file.")
+    parser.add_argument("--join-strategy", choices=["rec_key", "rec_id"], default=JOIN_STRATEGY)
+    args = parser.parse_args()
+    process_recordings_data(args.join_strategy)
@@ -0,0 +1,17 @@
+# Script to sort observations by YKJ square into a memory-mappable Arrow IPC file and build a square index for it
+
+from pathlib import Path
+from helpers.config import OBSERVATIONS_YKJ_FILE
+from helpers.square_index import build_square_index, get_square_index_files, square_row_counts
+
+input_file = OBSERVATIONS_YKJ_FILE
+sorted_file, index_file = get_square_index_files(input_file)
+row_counts_file = Path("./output/square_row_counts.csv")
+
+square_index = build_square_index(input_file, sorted_file, index_file)
+print(f"Indexed {len(square_index)} squares to {index_file}")
+
+# Save per-square row counts for balancing work
+row_counts_file.parent.mkdir(parents=True, exist_ok=True)
+square_row_counts(square_index).write_csv(row_counts_file, separator=";")
+print(f"Saved square row counts to {row_counts_file}")
@@ -2,9 +2,13 @@
 
 import polars as pl
 from pyproj import Transformer
+from helpers.config import DATA_DIR, SAMPLE_SUFFIX
+from helpers.instrumentation import stage, write_run_report
 
 # Read the parquet file
-df = pl.read_parquet("/data/observations_sample.parquet")
+with stage("read_parquet") as record:
+    df = pl.read_parquet(DATA_DIR / f"observations{SAMPLE_SUFFIX}.parquet")
+    record["rows_out"] = len(df)
 
 # Remove rows where either lat or lon is empty
 df = df.filter(pl.col("lat").is_not_null() & pl.col("lon").is_not_null())
@@ -13,10 +17,11 @@ df = df.filter(pl.col("lat").is_not_null() & pl.col("lon").is_not_null())
 transformer = Transformer.from_crs("EPSG:4326", "EPSG:2393", always_xy=True)
 
 # Convert coordinates in batches using vectorized operations
-x, y = transformer.transform(
-    df["lon"].to_numpy(),
-    df["lat"].to_numpy()
-)
+with stage("transform_coordinates", rows_in=len(df)):
+    x, y = transformer.transform(
+        df["lon"].to_numpy(),
+        df["lat"].to_numpy()
+    )
 
 # Add the new columns to the dataframe using Polars expressions
 df = df.with_columns([
@@ -25,4 +30,7 @@ df = df.with_columns([
 ])
 
 # Save as parquet
-df.write_parquet("/data/observations_ykj_sample.parquet")
+with stage("write_parquet", rows_in=len(df)):
+    df.write_parquet(DATA_DIR / f"observations_ykj{SAMPLE_SUFFIX}.parquet")
+
+write_run_report("prepare_ykj")
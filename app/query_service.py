@@ -0,0 +1,272 @@
+# Script to run a local HTTP service that answers common questions about the observations, from data loaded once to memory
+
+import argparse
+import json
+import time
+import polars as pl
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+from helpers.config import OBSERVATIONS_YKJ_FILE
+from helpers.get_atlas_data import read_bird_species_lookup
+from helpers.square_index import get_square_index_files, load_square_index, open_sorted_observations, read_square_observations
+
+'''
+Loads the square-sorted observations built by prepare_square_index.py memory-mapped, the cached atlas
+square data and the taxonomy once, and answers queries with JSON. Results of recent queries are kept in
+a cache, so that repeated questions are answered without computing them again.
+
+Endpoints:
+
+/square?n=667&e=337                        Species observed in a square, with their atlas class in the square
+/square?n=667&e=337&species=Parus major    Observations of a species in a square
+/user?user=user1&limit=20                  Species a user has observed most
+/months?species=Parus major                Observations by month, of all species if species is not given
+/status                                    Loaded data and cache statistics
+
+Run prepare_square_index.py first, and start the service from the app directory, e.g.
+python query_service.py --port 8050
+'''
+
+HOST = "127.0.0.1"
+PORT = 8050
+
+QUERY_CACHE_SIZE = 1024
+DEFAULT_LIMIT = 100
+
+ATLAS_CACHE_DIR = Path("./cache")
+FINBIF_SPECIES_FILE = Path(__file__).parent / "species_list.csv"
+
+OBSERVATION_COLUMNS = ["date", "time", "user_anon", "lat", "lon", "prediction", "song_start", "rec_id", "url"]
+
+# Loaded once by load_data
+DATA = {}
+
+
+def load_atlas_cache():
+    """Load atlas class of each species in each cached atlas square."""
+    atlas_classes = {}
+    for cache_file in ATLAS_CACHE_DIR.glob("*_*.json"):
+        ykj_n, ykj_e = cache_file.stem.split("_")
+        with open(cache_file, "r") as f:
+            square_data = json.load(f)
+        atlas_classes[(int(ykj_n), int(ykj_e))] = {
+            species["speciesId"]: species["atlasClass"]
+            for species in square_data.get("data", [])
+        }
+    return atlas_classes
+
+
+def load_data():
+    """Load observations, square index, atlas cache and taxonomy."""
+    sorted_file, index_file = get_square_index_files(OBSERVATIONS_YKJ_FILE)
+    if not sorted_file.exists() or not index_file.exists():
+        raise FileNotFoundError(f"Square index not found: {index_file}. Run prepare_square_index.py first.")
+
+    print(f"Loading {sorted_file}...")
+    table = open_sorted_observations(sorted_file)
+    DATA["table"] = table
+    # Built on the memory-mapped buffers, so most columns are not copied to memory
+    DATA["observations"] = pl.from_arrow(table)
+    DATA["square_index"] = load_square_index(index_file)
+
+    DATA["atlas_classes"] = load_atlas_cache()
+    try:
+        DATA["finnish_names"] = read_bird_species_lookup()
+    except FileNotFoundError:
+        DATA["finnish_names"] = {}
+    DATA["taxonomy"] = pl.read_csv(FINBIF_SPECIES_FILE, separator=";").select(["finbif_species", "identifier"])
+
+    print(f"Loaded {len(table)} observations in {len(DATA['square_index'])} squares, atlas data of {len(DATA['atlas_classes'])} squares")
+
+
+def species_filter(species):
+    """Expression matching a species by scientific name or FinBIF identifier."""
+    return (pl.col("finbif_species") == species) | (pl.col("identifier") == species)
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def query_square_species(ykj_n, ykj_e):
+    """Return species observed in a square, with their atlas class in the square."""
+    square_observations = read_square_observations(DATA["table"], DATA["square_index"], ykj_n, ykj_e)
+    atlas_classes = DATA["atlas_classes"].get((ykj_n, ykj_e), {})
+
+    species_counts = square_observations \
+        .group_by(["finbif_species", "identifier"]) \
+        .agg([
+            pl.len().alias("observations"),
+            pl.col("rec_id").n_unique().alias("recordings"),
+            pl.col("prediction").max().alias("max_prediction")
+        ]) \
+        .sort("observations", descending=True)
+
+    species = []
+    for row in species_counts.iter_rows(named=True):
+        row["finnish_name"] = DATA["finnish_names"].get(row["identifier"])
+        row["atlas_class"] = atlas_classes.get(row["identifier"])
+        species.append(row)
+
+    return {
+        "n": ykj_n,
+        "e": ykj_e,
+        "observations": len(square_observations),
+        "atlas_data_cached": (ykj_n, ykj_e) in DATA["atlas_classes"],
+        "species": species
+    }
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def query_square_observations(ykj_n, ykj_e, species, limit):
+    """Return observations of a species in a square, highest predictions first."""
+    square_observations = read_square_observations(DATA["table"], DATA["square_index"], ykj_n, ykj_e) \
+        .filter(species_filter(species)) \
+        .sort("prediction", descending=True)
+
+    return {
+        "n": ykj_n,
+        "e": ykj_e,
+        "species": species,
+        "atlas_class": DATA["atlas_classes"].get((ykj_n, ykj_e), {}).get(
+            square_observations["identifier"][0] if len(square_observations) else None
+        ),
+        "observations": len(square_observations),
+        "rows": square_observations.select(OBSERVATION_COLUMNS).head(limit).to_dicts()
+    }
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def query_user_top_species(user, limit):
+    """Return species a user has observed most."""
+    top_species = DATA["observations"] \
+        .filter(pl.col("user_anon") == user) \
+        .group_by(["finbif_species", "identifier"]) \
+        .agg([
+            pl.len().alias("observations"),
+            pl.col("rec_id").n_unique().alias("recordings")
+        ]) \
+        .sort(["observations", "finbif_species"], descending=[True, False]) \
+        .head(limit)
+
+    return {
+        "user": user,
+        "species": top_species.to_dicts()
+    }
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def query_monthly_counts(species):
+    """Return observations by month, of one species or all species."""
+    observations = DATA["observations"]
+    if species is not None:
+        observations = observations.filter(species_filter(species))
+
+    monthly_counts = observations \
+        .group_by("month") \
+        .agg(pl.len().alias("observations")) \
+        .sort("month")
+
+    return {
+        "species": species,
+        "months": monthly_counts.to_dicts()
+    }
+
+
+def query_status():
+    """Return loaded data and query cache statistics."""
+    return {
+        "observations": len(DATA["table"]),
+        "squares": len(DATA["square_index"]),
+        "atlas_squares": len(DATA["atlas_classes"]),
+        "taxonomy_species": len(DATA["taxonomy"]),
+        "caches": {
+            query.__name__: query.cache_info()._asdict()
+            for query in (query_square_species, query_square_observations, query_user_top_species, query_monthly_counts)
+        }
+    }
+
+
+def get_param(params, name, convert=str, default=None):
+    """Return a query parameter converted to a type, or default if it is not given."""
+    if name not in params:
+        if default is None:
+            raise ValueError(f"Missing parameter: {name}")
+        return default
+    try:
+        return convert(params[name][0])
+    except ValueError:
+        raise ValueError(f"Invalid value for parameter {name}: {params[name][0]}")
+
+
+def route_square(params):
+    ykj_n = get_param(params, "n", int)
+    ykj_e = get_param(params, "e", int)
+    if "species" in params:
+        return query_square_observations(ykj_n, ykj_e, get_param(params, "species"), get_param(params, "limit", int, DEFAULT_LIMIT))
+    return query_square_species(ykj_n, ykj_e)
+
+
+def route_user(params):
+    return query_user_top_species(get_param(params, "user"), get_param(params, "limit", int, DEFAULT_LIMIT))
+
+
+def route_months(params):
+    return query_monthly_counts(params["species"][0] if "species" in params else None)
+
+
+ROUTES = {
+    "/square": route_square,
+    "/user": route_user,
+    "/months": route_months,
+    "/status": lambda params: query_status(),
+}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        start_time = time.perf_counter()
+        url = urlparse(self.path)
+
+        route = ROUTES.get(url.path)
+        if route is None:
+            self.send_json(404, {"error": f"Unknown endpoint: {url.path}", "endpoints": list(ROUTES)}, start_time)
+            return
+
+        try:
+            result = route(parse_qs(url.query))
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)}, start_time)
+            return
+
+        self.send_json(200, result, start_time)
+
+    def send_json(self, status, body, start_time):
+        content = json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("X-Query-Time-Ms", f"{(time.perf_counter() - start_time) * 1000:.2f}")
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve queries about the observations over HTTP.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+
+    load_data()
+
+    server = ThreadingHTTPServer((args.host, args.port), QueryHandler)
+    print(f"Serving queries at http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,9 @@
 # Export part of Parquet file to CSV for testing
 
 import polars as pl
-from pathlib import Path
+from helpers.config import DATA_DIR
 
-input_file = Path("/data/observations_ykj.parquet")
+input_file = DATA_DIR / "observations_ykj.parquet"
 
 # Read the parquet file
 df = pl.read_parquet(input_file)